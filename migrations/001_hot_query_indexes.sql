@@ -0,0 +1,31 @@
+-- Composite and partial indexes for the hot query shapes (see __table_args__ in src/models.py)
+-- CONCURRENTLY doesn't lock the tables for writes, run this file outside of a transaction:
+--   psql "$DATABASE_URL" -f migrations/001_hot_query_indexes.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_submissions_user_id_created_at
+    ON submissions (user_id, created_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_submissions_goal_id_created_at
+    ON submissions (goal_id, created_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_submissions_created_at
+    ON submissions (created_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_submissions_voice_channel_created_at
+    ON submissions (voice_channel, created_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_submissions_user_id_created_at_without_proof
+    ON submissions (user_id, created_at)
+    WHERE proof_url IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_goals_user_id_category_id_created_at
+    ON goals (user_id, category_id, created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_goals_user_id_active_created_at
+    ON goals (user_id, active, created_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_goals_category_id
+    ON goals (category_id);
+
+ANALYZE submissions;
+ANALYZE goals;
@@ -0,0 +1,21 @@
+-- Daily rollup of submissions by user, category and day (see DailyActivity in src/models.py)
+--   psql "$DATABASE_URL" -f migrations/002_daily_activity.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS daily_activity (
+    user_id BIGINT NOT NULL REFERENCES users (user_id),
+    category_id INTEGER NOT NULL REFERENCES categories (category_id),
+    day DATE NOT NULL,
+    submissions INTEGER NOT NULL DEFAULT 0,
+    amount DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, category_id, day)
+);
+
+CREATE INDEX IF NOT EXISTS ix_daily_activity_day_category_id
+    ON daily_activity (day, category_id);
+
+COMMIT;
+
+-- Fill the table from the existing submissions:
+--   python -m src.analytics.rebuild daily_activity
@@ -0,0 +1,13 @@
+-- Precomputed leaderboards (see LeaderboardSnapshot in src/models.py)
+--   psql "$DATABASE_URL" -f migrations/003_leaderboard_snapshots.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS leaderboard_snapshots (
+    name VARCHAR PRIMARY KEY,
+    computed_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    rows JSON NOT NULL,
+    message_chunks JSON NOT NULL
+);
+
+COMMIT;
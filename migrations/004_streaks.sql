@@ -0,0 +1,19 @@
+-- Streaks by user and goal (see Streak in src/models.py)
+--   psql "$DATABASE_URL" -f migrations/004_streaks.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS streaks (
+    user_id BIGINT NOT NULL REFERENCES users (user_id),
+    goal_id INTEGER NOT NULL REFERENCES goals (goal_id),
+    current_start DATE,
+    last_day DATE,
+    current_streak INTEGER NOT NULL DEFAULT 0,
+    longest_streak INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, goal_id)
+);
+
+COMMIT;
+
+-- Fill the table from the existing submissions:
+--   python -m src.analytics.rebuild streaks
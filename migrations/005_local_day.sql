@@ -0,0 +1,27 @@
+-- Day bucketing in the user's time zone (see local_day in src/models.py)
+-- CREATE INDEX CONCURRENTLY can't run in a transaction, run this file without one:
+--   psql "$DATABASE_URL" -f migrations/005_local_day.sql
+
+CREATE OR REPLACE FUNCTION local_day(created_at timestamptz, time_zone_shift integer)
+RETURNS date AS $$
+    SELECT ((created_at AT TIME ZONE 'UTC') + make_interval(hours => COALESCE(time_zone_shift, 0)))::date
+$$ LANGUAGE SQL IMMUTABLE PARALLEL SAFE;
+
+ALTER TABLE submissions ADD COLUMN IF NOT EXISTS time_zone_shift INTEGER;
+
+-- the current time zone of the users is the best guess for the old submissions
+UPDATE submissions s
+    SET time_zone_shift = u.time_zone_shift
+    FROM users u
+    WHERE u.user_id = s.user_id
+      AND s.time_zone_shift IS NULL
+      AND u.time_zone_shift IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_submissions_user_id_local_day
+    ON submissions (user_id, local_day(created_at, time_zone_shift));
+
+ANALYZE submissions;
+
+-- Re-bucket the stores by the local days:
+--   python -m src.analytics.rebuild daily_activity
+--   python -m src.analytics.rebuild streaks
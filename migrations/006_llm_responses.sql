@@ -0,0 +1,16 @@
+-- Persisted LLM responses of submission parsing (see LLMResponse in src/models.py),
+--   only used with LLM_CACHE_PERSIST=true
+--   psql "$DATABASE_URL" -f migrations/006_llm_responses.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key VARCHAR PRIMARY KEY,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    response VARCHAR NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_llm_responses_created_at
+    ON llm_responses (created_at);
+
+COMMIT;
@@ -1,96 +1,268 @@
 import os
+import math
+import asyncio
+import logging
 import datetime
-from collections import defaultdict
+from dataclasses import dataclass
 
 import dotenv
 
-from src.database import get_categories, list_leaderboards, list_submissions_by_voice_channel, select_raw, update_leaderboard_last_sent
+from src.database import (
+    select_raw,
+    get_categories,
+    list_leaderboards,
+    get_leaderboard_snapshot,
+    save_leaderboard_snapshot,
+    update_leaderboard_last_sent,
+)
 from src.models import Leaderboard
+from src.analytics.usernames import resolve_usernames
 
 
 dotenv.load_dotenv()
 
+logger = logging.getLogger(__name__)
 
 LEADERBOARD_CHANNEL_ID = os.environ['DISCORD_SETTINGS_CHANNEL_ID']
+LEADERBOARD_REFRESH_INTERVAL_SECONDS = int(os.getenv('LEADERBOARD_REFRESH_INTERVAL_SECONDS', 10 * 60))
 
+WEEKLY_LEADERBOARD_SNAPSHOT = 'weekly'
+DISCORD_MESSAGE_LIMIT = 2000
+QUOTE_PREFIX = '>>> '
 
-async def _get_category_leaderboard(category_id: int):
-    submissions = await select_raw("""
-        SELECT s.user_id, DATE(s.created_at), count(*)
-            FROM submissions s
-            JOIN goals g ON s.goal_id = g.goal_id
-            WHERE s.created_at > now() - interval '1 week' AND g.category_id = :category_id
-            GROUP BY s.user_id, DATE(s.created_at)
-            ORDER BY count(*) DESC
-    """, category_id=category_id)
 
-    sumbissions_by_user = defaultdict(int)
-    days_by_user = defaultdict(int)
-
-    for user_id, date, count in submissions:
-        sumbissions_by_user[user_id] += count
-        days_by_user[user_id] += 1
-
-    return sorted([
-        (user_id, sumbissions_by_user[user_id], days_by_user[user_id])
-        for user_id in sumbissions_by_user
-    ], key=lambda x: x[2], reverse=True)
+async def _get_weekly_leaderboard_rows():
+    """ Ranks users of every category in one query
+    Returns rows of (category_id, user_id, submissions, active days, rank),
+      ordered by category and rank.
+    """
+    return await select_raw("""
+        SELECT category_id,
+               user_id,
+               sum(submissions) AS submissions,
+               count(*) AS active_days,
+               RANK() OVER (
+                   PARTITION BY category_id
+                   ORDER BY count(*) DESC
+               ) AS rank
+            FROM daily_activity
+            -- one week for everybody, ending on the current UTC day
+            WHERE day > local_day(now(), 0) - 7
+            GROUP BY category_id, user_id
+            ORDER BY category_id, rank, submissions DESC
+    """)
 
 
 async def get_weekly_leaderboard():
+    """ Returns {category name: [(user_id, submissions, active days, rank), ...]} """
     categories = await get_categories()
 
-    leaderboards = {}
-
-    for category in categories:
-        leaderboard = await _get_category_leaderboard(category.category_id)
-        leaderboards[category.name] = leaderboard
+    leaderboards = {category.name: [] for category in categories}
+    category_names = {category.category_id: category.name for category in categories}
 
-    #print(leaderboards)
+    for category_id, user_id, submissions, days, rank in await _get_weekly_leaderboard_rows():
+        leaderboards[category_names[category_id]].append((user_id, submissions, days, rank))
 
     return leaderboards
 
 
+@dataclass
+class WeeklyRank:
+    rank: int
+    participants: int
+    submissions: int
+    active_days: int
+
+    @property
+    def top_percent(self) -> int:
+        """ 1 for the first place of 100 participants, 100 for the last place """
+        return math.ceil(100 * self.rank / self.participants)
+
+    @property
+    def standing(self) -> str:
+        if self.participants == 1:
+            # "top 100%" would read as the last place
+            return "the only participant"
+        return f"top {self.top_percent}%"
+
+
+async def get_weekly_ranks(user_id: int) -> dict[str, WeeklyRank]:
+    """ Returns the rank of the user in each category of the weekly leaderboard
+    Only the categories the user is active in are ranked, with the same
+      ordering as get_weekly_leaderboard, but over the week ending on the user's
+      local day (like get_weekly_activity), so /rank matches /stats.
+    """
+    rows = await select_raw("""
+        WITH week AS (
+            SELECT local_day(now(), (SELECT time_zone_shift FROM users WHERE user_id = :user_id)) - 7 AS after_day
+        )
+        SELECT category_id, rank, participants, submissions, active_days
+            FROM (
+                SELECT category_id,
+                       user_id,
+                       sum(submissions) AS submissions,
+                       count(*) AS active_days,
+                       RANK() OVER (
+                           PARTITION BY category_id
+                           ORDER BY count(*) DESC
+                       ) AS rank,
+                       count(*) OVER (PARTITION BY category_id) AS participants
+                    FROM daily_activity
+                    WHERE day > (SELECT after_day FROM week)
+                      AND category_id IN (
+                          SELECT category_id
+                              FROM daily_activity
+                              WHERE user_id = :user_id AND day > (SELECT after_day FROM week)
+                      )
+                    GROUP BY category_id, user_id
+            ) AS ranked
+            WHERE user_id = :user_id
+            ORDER BY rank
+    """, user_id=user_id)
+
+    category_names = {category.category_id: category.name for category in await get_categories()}
+
+    return {
+        category_names[category_id]: WeeklyRank(
+            rank=rank,
+            participants=participants,
+            submissions=submissions,
+            active_days=active_days,
+        )
+        for category_id, rank, participants, submissions, active_days in rows
+    }
+
+
+def _voice_leaderboard_snapshot_name(leaderboard: Leaderboard) -> str:
+    return f"voice_{leaderboard.leaderboard_id}"
+
+
+def _split_message(lines: list[str], limit: int = DISCORD_MESSAGE_LIMIT) -> list[str]:
+    """ Joins the lines into as few block quoted messages as fit the limit """
+    max_length = limit - len(QUOTE_PREFIX)
+    chunks = []
+    current, current_length = [], 0
+
+    for line in lines:
+        line = line[:max_length]
+        # +1 for the line break
+        if current and current_length + 1 + len(line) > max_length:
+            chunks.append(QUOTE_PREFIX + "\n".join(current))
+            current, current_length = [], 0
+
+        current_length += len(line) + (1 if current else 0)
+        current.append(line)
+
+    if current:
+        chunks.append(QUOTE_PREFIX + "\n".join(current))
+
+    return chunks
+
+
+async def _render_weekly_leaderboard(discord_client) -> tuple[dict, list[str]]:
+    """ Returns (rows by category, message chunks) """
+    leaderboards = await get_weekly_leaderboard()
+    usernames = await resolve_usernames(discord_client, [
+        user_id for leaderboard in leaderboards.values() for user_id, *_ in leaderboard
+    ])
+
+    current_date = datetime.datetime.now().strftime("%d-%b-%Y")
+
+    msg_parts = [f"**Weekly leaderboard: {current_date}**\n"]
+
+    for category, leaderboard in leaderboards.items():
+        if leaderboard:
+            msg_parts.append(f"**{category}**")
+            for user_id, submissions, days, rank in leaderboard:
+                msg_parts.append(f"{rank}. {usernames[user_id]}: {submissions} submissions, {days} active days")
+            msg_parts.append("")
+
+    rows = {
+        category: [list(row) for row in leaderboard]
+        for category, leaderboard in leaderboards.items()
+    }
+    return rows, _split_message(msg_parts)
+
+
 def _should_send_leaderboard(leaderboard, now):
     return (
-        leaderboard.last_sent is not None and 
-        now - leaderboard.last_sent < datetime.timedelta(hours=24)
+        leaderboard.last_sent is None or
+        now - leaderboard.last_sent >= datetime.timedelta(hours=24)
     )
 
 
-async def _get_leaderboard_message(leaderboard: Leaderboard, discord_client):
-    current_date = datetime.now().strftime("%d-%b-%Y")
-    
-    voice_channels = leaderboard.voice_channels.split(',')
-    
-    hours = []
-    
-    for voice_channel in voice_channels:
-        channel_submissions = list_submissions_by_voice_channel(
-            voice_channel)
-        
-        hours.extend(channel_submissions)
-    
-    hours_by_user = defaultdict(float)
-    days_by_user = defaultdict(set)
-    for submission in hours:
-        hours_by_user[submission.user_id] += submission.amount / 60
-        days_by_user[submission.user_id].add(submission.created_at.date())
-        
-    board_data = sorted([
-        (user_id, hours_by_user[user_id], len(days_by_user[user_id]))
-        for user_id in hours_by_user
-    ], key=lambda x: x[1], reverse=True)
+async def _get_voice_leaderboard_rows(voice_channels: list[str]):
+    """ Ranks users by the time spent in any of the voice channels last week
+    Returns rows of (user_id, hours, active days), ordered by hours.
+    """
+    return await select_raw("""
+        SELECT user_id,
+               sum(amount) / 60 AS hours,
+               count(DISTINCT local_day(created_at, time_zone_shift)) AS active_days
+            FROM submissions
+            WHERE voice_channel = ANY(:voice_channels)
+              AND created_at > now() - interval '1 week'
+            GROUP BY user_id
+            ORDER BY hours DESC
+    """, voice_channels=voice_channels)
+
+
+async def _render_voice_leaderboard(leaderboard: Leaderboard, discord_client) -> tuple[list, list[str]]:
+    """ Returns (rows, message chunks) """
+    current_date = datetime.datetime.now().strftime("%d-%b-%Y")
+
+    voice_channels = [
+        voice_channel.strip() for voice_channel in leaderboard.voice_channels.split(',')
+    ]
+    board_data = await _get_voice_leaderboard_rows(voice_channels)
+
+    usernames = await resolve_usernames(discord_client, [user_id for user_id, *_ in board_data])
 
-    msg_parts = [f">>> **Weekly leaderboard {leaderboard.name}: {current_date}**\n"]
+    msg_parts = [f"**Weekly leaderboard {leaderboard.name}: {current_date}**\n"]
     for user_id, hours, days in board_data:
-        username = (await discord_client.fetch_user(user_id)).global_name
-        msg_parts.append(f"{username}: {hours:.2f} hours, {days} active days")
+        msg_parts.append(f"{usernames[user_id]}: {hours:.2f} hours, {days} active days")
     msg_parts.append("")
 
-    msg = "\n".join(msg_parts)
-    
-    return msg
+    rows = [list(row) for row in board_data]
+    return rows, _split_message(msg_parts)
+
+
+async def refresh_leaderboard_snapshots(discord_client):
+    """ Recomputes all leaderboards and saves them as snapshots """
+    rows, message_chunks = await _render_weekly_leaderboard(discord_client)
+    await save_leaderboard_snapshot(WEEKLY_LEADERBOARD_SNAPSHOT, rows, message_chunks)
+
+    for leaderboard in await list_leaderboards():
+        rows, message_chunks = await _render_voice_leaderboard(leaderboard, discord_client)
+        await save_leaderboard_snapshot(
+            _voice_leaderboard_snapshot_name(leaderboard), rows, message_chunks)
+
+
+async def get_leaderboard_message_chunks(discord_client, snapshot_name: str) -> list[str]:
+    """ Returns the message of the latest snapshot,
+    the snapshots are refreshed first if there is none yet (e.g. a new leaderboard).
+    """
+    snapshot = await get_leaderboard_snapshot(snapshot_name)
+    if snapshot is None:
+        await refresh_leaderboard_snapshots(discord_client)
+        snapshot = await get_leaderboard_snapshot(snapshot_name)
+
+    return snapshot.message_chunks if snapshot is not None else []
+
+
+async def refresh_leaderboard_snapshots_periodically(
+    discord_client,
+    interval_seconds: int = LEADERBOARD_REFRESH_INTERVAL_SECONDS,
+):
+    await discord_client.wait_until_ready()
+
+    while True:
+        try:
+            await refresh_leaderboard_snapshots(discord_client)
+        except Exception:
+            logger.exception("Failed to refresh leaderboard snapshots")
+
+        await asyncio.sleep(interval_seconds)
 
 
 async def send_voice_leaderboards(discord_client):
@@ -104,7 +276,9 @@ async def send_voice_leaderboards(discord_client):
         if not _should_send_leaderboard(leaderboard, now):
             continue
         
-        leaderboard_message = _get_leaderboard_message(leaderboard)
+        message_chunks = await get_leaderboard_message_chunks(
+            discord_client, _voice_leaderboard_snapshot_name(leaderboard))
         
-        await leaderboard_channel.send(leaderboard_message)
+        for message_chunk in message_chunks:
+            await leaderboard_channel.send(message_chunk)
         await update_leaderboard_last_sent(leaderboard.leaderboard_id, now)
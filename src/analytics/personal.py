@@ -1,9 +1,14 @@
-from dataclasses import dataclass
-from src.database import get_categories, select_raw
+import datetime
+from dataclasses import dataclass, field
+
+from src.database import get_categories, get_user, get_user_streaks, get_weekly_activity
+from src.models import local_day
+from src.analytics.streaks import StreakState
 
 @dataclass
 class PersonalStatistics:
     by_category: dict[str, 'PersonalCategoryStatistics']
+    streaks: dict[str, 'PersonalStreak'] = field(default_factory=dict)
 
 
 @dataclass
@@ -12,36 +17,40 @@ class PersonalCategoryStatistics:
     days_with_submissions: int
 
 
-def _get_category_statistics(submissions, category_id):
-    category_submissions = [
-        count for _, cat_id, count in submissions if cat_id == category_id
-    ]
-    return PersonalCategoryStatistics(
-        submissions_number=sum(category_submissions),
-        days_with_submissions=len(category_submissions),
-    )
+@dataclass
+class PersonalStreak:
+    current_streak: int
+    longest_streak: int
 
 
 async def get_personal_statistics(user_id: int) -> PersonalStatistics:
-    submissions = await select_raw("""
-        SELECT DATE(s.created_at), g.category_id, count(*)
-            FROM submissions s
-            JOIN goals g ON s.goal_id = g.goal_id
-            WHERE s.created_at > now() - interval '1 week' AND s.user_id = :user_id
-            GROUP BY DATE(s.created_at), g.category_id
-            ORDER BY count(*) DESC
-    """, user_id=user_id)
+    """ Weekly statistics and streaks by category, served from the cached helpers """
+    activity = await get_weekly_activity(user_id)
 
     all_categories = await get_categories()
-    all_categories = {
-        category.category_id: category for category in all_categories
+    category_names = {
+        category.category_id: category.name for category in all_categories
     }
-    user_categories = list(set([category_id for _, category_id, _ in submissions]))
 
-    result = {}
-
-    for category_id in user_categories:
-        category_name = all_categories[category_id].name
-        result[category_name] = _get_category_statistics(submissions, category_id)
+    result = {
+        category_names[category_id]: PersonalCategoryStatistics(
+            submissions_number=submissions,
+            days_with_submissions=days,
+        )
+        for category_id, submissions, days in activity
+    }
 
-    return PersonalStatistics(by_category=result)
+    user = await get_user(user_id)
+    today = local_day(
+        datetime.datetime.now(datetime.UTC),
+        user.time_zone_shift if user is not None else None,
+    )
+    streaks = {}
+    for category_id, current_start, last_day, current_streak, longest_streak in await get_user_streaks(user_id):
+        state = StreakState(current_start, last_day, current_streak, longest_streak)
+        streaks[category_names[category_id]] = PersonalStreak(
+            current_streak=state.current_streak_on(today),
+            longest_streak=longest_streak,
+        )
+
+    return PersonalStatistics(by_category=result, streaks=streaks)
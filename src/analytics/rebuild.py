@@ -0,0 +1,45 @@
+""" Rebuilds the analytics stores from the submissions history.
+
+Usage:
+    python -m src.analytics.rebuild {daily_activity,streaks} [--user-id USER_ID]
+"""
+import os
+import asyncio
+import argparse
+
+import dotenv
+
+from src.database import init_db, close_db, rebuild_daily_activity, rebuild_streaks
+
+
+REBUILDERS = {
+    'daily_activity': rebuild_daily_activity,
+    'streaks': rebuild_streaks,
+}
+
+
+async def rebuild(store: str, user_id=None):
+    DATABASE_URL = os.getenv('DATABASE_URL')
+    if not DATABASE_URL:
+        raise Exception("Please set the DATABASE_URL environment variable")
+
+    await init_db(DATABASE_URL)
+    try:
+        await REBUILDERS[store](user_id=user_id)
+    finally:
+        await close_db()
+
+
+def main():
+    dotenv.load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('store', choices=list(REBUILDERS))
+    parser.add_argument('--user-id', type=int, default=None)
+    args = parser.parse_args()
+
+    asyncio.run(rebuild(args.store, args.user_id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import datetime
+from dataclasses import dataclass, replace
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class StreakState:
+    """ Streak of consecutive days with submissions of a goal """
+    current_start: datetime.date
+    last_day: datetime.date
+    current_streak: int
+    longest_streak: int
+
+    def current_streak_on(self, today: datetime.date) -> int:
+        """ The current streak is still alive until the end of the next day """
+        if self.last_day >= today - datetime.timedelta(days=1):
+            return self.current_streak
+        return 0
+
+
+def advance_streak(state: Optional[StreakState], day: datetime.date) -> Optional[StreakState]:
+    """ Returns the streak after a submission on `day` in O(1)
+    Returns None when the day is before the current streak (a backdated submission),
+      it can join older streaks, so the goal must be recomputed from its history.
+    """
+    if state is None:
+        return StreakState(current_start=day, last_day=day, current_streak=1, longest_streak=1)
+
+    if state.current_start <= day <= state.last_day:
+        return state
+
+    if day < state.current_start:
+        return None
+
+    if day == state.last_day + datetime.timedelta(days=1):
+        current_streak = state.current_streak + 1
+        return replace(
+            state,
+            last_day=day,
+            current_streak=current_streak,
+            longest_streak=max(state.longest_streak, current_streak),
+        )
+
+    # a gap, a new streak starts
+    return replace(state, current_start=day, last_day=day, current_streak=1)
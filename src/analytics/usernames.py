@@ -0,0 +1,92 @@
+import os
+import asyncio
+import logging
+from typing import Iterable
+
+import discord
+
+from src.cache import TTLCache, register_cache
+from src.database import get_usernames
+
+
+logger = logging.getLogger(__name__)
+
+USERNAME_CACHE_SIZE = int(os.getenv('USERNAME_CACHE_SIZE', 5000))
+USERNAME_CACHE_TTL_SECONDS = float(os.getenv('USERNAME_CACHE_TTL_SECONDS', 6 * 60 * 60))
+# parallel REST calls for the users missing from the member cache and the database
+USERNAME_FETCH_CONCURRENCY = int(os.getenv('USERNAME_FETCH_CONCURRENCY', 5))
+
+
+USERNAMES_CACHE = register_cache('usernames', TTLCache(
+    maxsize=USERNAME_CACHE_SIZE,
+    ttl=USERNAME_CACHE_TTL_SECONDS,
+))
+
+
+def _display_name(user) -> str:
+    return user.global_name or user.name
+
+
+def _from_member_cache(discord_client, user_ids: list[int]) -> dict[int, str]:
+    usernames = {}
+    for user_id in user_ids:
+        # filled from the guild members, no request is made
+        user = discord_client.get_user(user_id)
+        if user is not None:
+            usernames[user_id] = _display_name(user)
+    return usernames
+
+
+async def _from_rest_api(discord_client, user_ids: list[int]) -> dict[int, str]:
+    semaphore = asyncio.Semaphore(USERNAME_FETCH_CONCURRENCY)
+
+    async def fetch(user_id):
+        async with semaphore:
+            try:
+                return user_id, _display_name(await discord_client.fetch_user(user_id))
+            except discord.NotFound:
+                logger.warning(f"User {user_id} not found on Discord")
+                return user_id, None
+            except discord.HTTPException:
+                # e.g. rate limited, the leaderboard is still rendered with the id
+                logger.exception(f"Failed to fetch user {user_id} from Discord")
+                return user_id, None
+
+    results = await asyncio.gather(*[fetch(user_id) for user_id in user_ids])
+    return {user_id: username for user_id, username in results if username}
+
+
+async def resolve_usernames(discord_client, user_ids: Iterable[int]) -> dict[int, str]:
+    """ Returns {user_id: username} for all of user_ids
+    Looks in the cache, the guild member cache and the users table,
+      and only calls the REST API for the remaining users.
+    Unknown users get their id as the name.
+    """
+    usernames = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        found, username = USERNAMES_CACHE.get(user_id)
+        if found:
+            usernames[user_id] = username
+        else:
+            missing.append(user_id)
+
+    resolved = _from_member_cache(discord_client, missing)
+    missing = [user_id for user_id in missing if user_id not in resolved]
+
+    if missing:
+        resolved.update(await get_usernames(missing))
+        missing = [user_id for user_id in missing if user_id not in resolved]
+
+    if missing:
+        resolved.update(await _from_rest_api(discord_client, missing))
+        missing = [user_id for user_id in missing if user_id not in resolved]
+
+    for user_id, username in resolved.items():
+        USERNAMES_CACHE.set(user_id, username)
+    usernames.update(resolved)
+
+    for user_id in missing:
+        usernames[user_id] = str(user_id)
+
+    return usernames
@@ -10,7 +10,7 @@ import dotenv
 import discord
 
 from src.submissions.process_message import process_discord_message
-from src.database import init_db
+from src.database import init_db, listen_for_cache_invalidations
 
 
 dotenv.load_dotenv()
@@ -55,7 +55,10 @@ async def init():
     await init_db(DATABASE_URL)
 
     discord.utils.setup_logging()
-    return await client.start(DISCORD_TOKEN)
+    return await asyncio.gather(
+        client.start(DISCORD_TOKEN),
+        listen_for_cache_invalidations(),
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+""" Checks that the hot queries use index scans on a large synthetic dataset.
+
+Usage:
+    python -m src.benchmarks.explain_hot_queries [--users 20000] [--submissions 2000000]
+
+The data is generated in a scratch schema of DATABASE_URL and dropped afterwards.
+"""
+import os
+import re
+import json
+import asyncio
+import argparse
+
+import dotenv
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src import database
+from src.models import Base
+from src.analytics.personal import get_personal_statistics
+from src.analytics.leaderboard import get_weekly_leaderboard, get_weekly_ranks, _get_voice_leaderboard_rows
+
+
+SCRATCH_SCHEMA = 'explain_hot_queries'
+# tables that must not be read with a sequential scan by the hot queries
+CHECKED_TABLES = {'submissions', 'goals', 'daily_activity'}
+READS_CHECKED_TABLE = re.compile(r'\b(FROM|JOIN)\s+(submissions|goals|daily_activity)\b', re.IGNORECASE)
+CATEGORIES_NUMBER = 6
+
+
+SEED_QUERIES = [
+    """
+    INSERT INTO categories (category_id, name, text_channel, voice_channel, allow_llm_submissions)
+        SELECT i, 'category_' || i, 'text_' || i, 'voice_' || i, true
+            FROM generate_series(1, :categories) AS i
+    """,
+    """
+    INSERT INTO users (user_id, username, time_zone_shift)
+        SELECT i, 'user_' || i, (i % 12) - 5
+            FROM generate_series(1, :users) AS i
+    """,
+    # ~2 goals per user, some of them are old (inactive) ones
+    """
+    INSERT INTO goals (user_id, category_id, created_at, goal_description, frequency, metric, target, active)
+        SELECT (i % :users) + 1, (i % :categories) + 1,
+               now() - (i % 365) * interval '1 day', '', '', '', 1, i % 5 <> 0
+            FROM generate_series(1, :users * 2) AS i
+    """,
+    # submissions spread over two years
+    """
+    INSERT INTO submissions (user_id, goal_id, created_at, amount, is_voice, voice_channel, time_zone_shift)
+        SELECT g.user_id, g.goal_id,
+               now() - random() * interval '730 days', 1,
+               i % 10 = 0, CASE WHEN i % 10 = 0 THEN 'voice_' || g.category_id END,
+               (g.user_id % 12) - 5
+            FROM generate_series(1, :submissions) AS i
+            JOIN goals g ON g.goal_id = (i % (:users * 2)) + 1
+    """,
+    "INSERT INTO daily_activity " + database._DAILY_ACTIVITY_SELECT.format(condition="true"),
+    "ANALYZE",
+]
+
+
+def _collect_scans(plan: dict, scans: list):
+    if 'Relation Name' in plan:
+        scans.append((plan['Relation Name'], plan['Node Type']))
+
+    for subplan in plan.get('Plans', []):
+        _collect_scans(subplan, scans)
+
+    return scans
+
+
+async def _explain(conn, statement, parameters) -> list[tuple[str, str]]:
+    # the statements are captured at the DBAPI level, so they use asyncpg $n params
+    raw_connection = await conn.get_raw_connection()
+    rows = await raw_connection.driver_connection.fetch(
+        f"EXPLAIN (FORMAT JSON) {statement}", *parameters)
+    explain = rows[0][0]
+    if isinstance(explain, str):
+        # SQLAlchemy registers a json codec on its connections, a plain one returns text
+        explain = json.loads(explain)
+    plan = explain[0]['Plan']
+    return _collect_scans(plan, [])
+
+
+async def check_hot_queries(database_url: str, users: int, submissions: int) -> bool:
+    engine = create_async_engine(
+        database_url,
+        connect_args={'server_settings': {'search_path': SCRATCH_SCHEMA}},
+    )
+
+    captured = []
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCRATCH_SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCRATCH_SCHEMA}"))
+        await conn.run_sync(Base.metadata.create_all)
+
+        print(f"Seeding {users} users and {submissions} submissions...")
+        for query in SEED_QUERIES:
+            await conn.execute(text(query), dict(
+                users=users, submissions=submissions, categories=CATEGORIES_NUMBER))
+
+    database.DB_ENGINE = engine
+    # name -> (call, tables that must not be read with a sequential scan)
+    hot_queries = {
+        'get_goal': (lambda: database.get_goal(1, 1), CHECKED_TABLES),
+        'get_user_goals': (lambda: database.get_user_goals(1), CHECKED_TABLES),
+        'get_personal_statistics': (lambda: get_personal_statistics(1), CHECKED_TABLES),
+        'get_weekly_leaderboard': (get_weekly_leaderboard, CHECKED_TABLES),
+        'get_weekly_ranks': (lambda: get_weekly_ranks(1), CHECKED_TABLES),
+        'voice_leaderboard': (lambda: _get_voice_leaderboard_rows(['voice_1', 'voice_2']), CHECKED_TABLES),
+    }
+
+    all_passed = True
+    try:
+        for name, (call, checked_tables) in hot_queries.items():
+            captured.clear()
+            await call()
+            # skip the lookups of other helpers, e.g. categories
+            statement, parameters = next(
+                (statement, parameters) for statement, parameters in captured
+                if READS_CHECKED_TABLE.search(statement)
+            )
+
+            async with engine.connect() as conn:
+                scans = await _explain(conn, statement, parameters)
+
+            seq_scans = [
+                table for table, node_type in scans
+                if table in checked_tables and node_type == 'Seq Scan'
+            ]
+            passed = not seq_scans
+            all_passed = all_passed and passed
+
+            scans_description = ", ".join(f"{table}: {node_type}" for table, node_type in scans)
+            print(f"{'OK  ' if passed else 'FAIL'} {name}: {scans_description}")
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCRATCH_SCHEMA} CASCADE"))
+        await engine.dispose()
+
+    return all_passed
+
+
+def main():
+    dotenv.load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--submissions', type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        raise Exception("Please set the DATABASE_URL environment variable")
+
+    passed = asyncio.run(check_hot_queries(database_url, args.users, args.submissions))
+    raise SystemExit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+""" Accuracy report and micro-benchmark of the rule-based submission parser.
+
+Usage:
+    python -m src.benchmarks.fast_parser [--corpus path.jsonl] [--iterations 1000]
+
+Each corpus line is {"text": ..., "goals": {category: metric}, "expected": [[day shift, category, value], ...]},
+`expected` is what the LLM should extract. The report shows how many messages
+the fast path handles (coverage), how many of those it gets right (precision)
+and the messages it gets wrong, which would be saved without the LLM.
+"""
+import json
+import time
+import argparse
+from pathlib import Path
+
+from src.submissions.fast_parser import parse_structured_message
+
+
+DEFAULT_CORPUS = Path(__file__).parent / 'data' / 'submission_messages.jsonl'
+
+
+def load_corpus(path: Path) -> list[dict]:
+    with open(path, encoding='utf-8') as corpus_file:
+        return [json.loads(line) for line in corpus_file if line.strip()]
+
+
+def accuracy_report(corpus: list[dict]) -> dict:
+    handled, correct, wrong = 0, 0, []
+
+    for example in corpus:
+        items = parse_structured_message(example['text'], example['goals'])
+        if items is None:
+            continue
+
+        handled += 1
+        if [list(item) for item in items] == example['expected']:
+            correct += 1
+        else:
+            wrong.append((example['text'], items, example['expected']))
+
+    return {
+        'messages': len(corpus),
+        'handled': handled,
+        'correct': correct,
+        'coverage': handled / len(corpus) if corpus else 0,
+        'precision': correct / handled if handled else 0,
+        'wrong': wrong,
+    }
+
+
+def time_per_message(corpus: list[dict], iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for example in corpus:
+            parse_structured_message(example['text'], example['goals'])
+    return (time.perf_counter() - started) / (iterations * len(corpus))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument('--iterations', type=int, default=1000)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    report = accuracy_report(corpus)
+
+    print(f"messages:  {report['messages']}")
+    print(f"coverage:  {report['coverage']:.0%} ({report['handled']} parsed without the LLM)")
+    print(f"precision: {report['precision']:.0%} ({report['correct']} of {report['handled']} correct)")
+    for text, items, expected in report['wrong']:
+        print(f"  WRONG {text!r}: {items} != {expected}")
+
+    print(f"time:      {time_per_message(corpus, args.iterations) * 1e6:.1f} us per message")
+
+    raise SystemExit(1 if report['wrong'] else 0)
+
+
+if __name__ == "__main__":
+    main()
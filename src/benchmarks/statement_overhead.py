@@ -0,0 +1,104 @@
+""" Micro-benchmark of the per-call statement overhead of the database helpers.
+
+Usage:
+    python -m src.benchmarks.statement_overhead [--iterations 20000]
+
+Compares building a new Core statement (or text()) on every call with
+the prebuilt statements of src/database.py. The statements run on an
+in-memory SQLite database, so the timings are dominated by the Python
+side (statement construction, cache key generation, compiled cache lookup).
+"""
+import time
+import argparse
+
+from sqlalchemy import create_engine, insert, select, text
+
+from src import database
+from src.models import Base, Category, Goal, User
+
+
+RAW_QUERY = """
+    SELECT s.user_id, count(*)
+        FROM submissions s
+        WHERE s.user_id = :user_id
+        GROUP BY s.user_id
+"""
+
+
+def _seed(conn):
+    conn.execute(insert(User).values(user_id=1, username='user'))
+    conn.execute(insert(Category).values(category_id=1, name='Fitness'))
+    conn.execute(insert(Goal).values(user_id=1, category_id=1, goal_description='', active=True))
+
+
+def _adhoc_get_user(conn):
+    return conn.execute(select(User).where(User.user_id == 1)).first()
+
+
+def _prebuilt_get_user(conn):
+    return conn.execute(database._GET_USER_STMT, dict(user_id=1)).first()
+
+
+def _adhoc_get_goal(conn):
+    return conn.execute(
+        select(Goal)
+            .where(Goal.category_id == 1)
+            .where(Goal.user_id == 1)
+            .order_by(Goal.created_at.desc())
+    ).first()
+
+
+def _prebuilt_get_goal(conn):
+    return conn.execute(database._GET_GOAL_STMT, dict(category_id=1, user_id=1)).first()
+
+
+def _adhoc_select_raw(conn):
+    return conn.execute(text(RAW_QUERY), dict(user_id=1)).fetchall()
+
+
+def _prebuilt_select_raw(conn):
+    return conn.execute(database._raw_query(RAW_QUERY), dict(user_id=1)).fetchall()
+
+
+BENCHMARKS = {
+    'get_user': (_adhoc_get_user, _prebuilt_get_user),
+    'get_goal': (_adhoc_get_goal, _prebuilt_get_goal),
+    'select_raw': (_adhoc_select_raw, _prebuilt_select_raw),
+}
+
+
+def _time_per_call(conn, call, iterations: int) -> float:
+    # warm up the compiled cache
+    for _ in range(100):
+        call(conn)
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call(conn)
+    return (time.perf_counter() - started) / iterations
+
+
+def run(iterations: int):
+    engine = create_engine("sqlite://", query_cache_size=database.DB_QUERY_CACHE_SIZE)
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        _seed(conn)
+
+        print(f"{'helper':<12} {'before, us':>12} {'after, us':>12} {'speedup':>8}")
+        for name, (adhoc, prebuilt) in BENCHMARKS.items():
+            before = _time_per_call(conn, adhoc, iterations)
+            after = _time_per_call(conn, prebuilt, iterations)
+            print(f"{name:<12} {before * 1e6:>12.1f} {after * 1e6:>12.1f} {before / after:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=20_000)
+    args = parser.parse_args()
+
+    run(args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import os
+import time
+import asyncio
+import functools
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional, Sequence
+
+
+DEFAULT_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', 60 * 60))
+# `None` results ("not found") are kept shorter, so new rows show up quickly
+DEFAULT_NEGATIVE_TTL_SECONDS = float(os.getenv('CACHE_NEGATIVE_TTL_SECONDS', 60))
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+
+class TTLCache:
+    """ LRU cache with a TTL for values and a separate TTL for `None` values """
+
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        ttl: Optional[float] = DEFAULT_TTL_SECONDS,
+        negative_ttl: Optional[float] = DEFAULT_NEGATIVE_TTL_SECONDS,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stats = CacheStats()
+        # key -> (expires_at, value)
+        self._data: OrderedDict[Hashable, tuple[Optional[float], Any]] = OrderedDict()
+        # key -> the running load of this key, shared by concurrent callers
+        self.in_flight: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        """ Returns (found, value) """
+        entry = self._data.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return False, None
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return False, None
+
+        self._data.move_to_end(key)
+        self.stats.hits += 1
+        return True, value
+
+    def set(self, key: Hashable, value: Any):
+        ttl = self.negative_ttl if value is None else self.ttl
+        if ttl is not None and ttl <= 0:
+            return
+
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.stats.evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        self.stats.invalidations += 1
+        self.in_flight.pop(key, None)
+        return self._data.pop(key, None) is not None
+
+    def clear(self):
+        self.stats.invalidations += 1
+        self.in_flight.clear()
+        self._data.clear()
+
+    def info(self) -> dict:
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'negative_ttl': self.negative_ttl,
+            'hits': self.stats.hits,
+            'misses': self.stats.misses,
+            'evictions': self.stats.evictions,
+            'expirations': self.stats.expirations,
+            'invalidations': self.stats.invalidations,
+        }
+
+
+# all named caches of the process, used by stats and invalidation
+CACHES: dict[str, TTLCache] = {}
+
+
+def register_cache(name: str, cache: TTLCache) -> TTLCache:
+    if name in CACHES:
+        raise ValueError(f"Cache {name} is already registered")
+    CACHES[name] = cache
+    return cache
+
+
+def invalidate_cache(name: str, key: Optional[Sequence] = None) -> bool:
+    """ Invalidates a single key (the call arguments) or the whole cache (when key is None)
+    Returns False if there is no such cache.
+    """
+    cache = CACHES.get(name)
+    if cache is None:
+        return False
+
+    if key is None:
+        cache.clear()
+    else:
+        cache.invalidate(tuple(key))
+
+    return True
+
+
+def clear_all_caches():
+    for cache in CACHES.values():
+        cache.clear()
+
+
+def get_cache_stats() -> dict[str, dict]:
+    return {name: cache.info() for name, cache in CACHES.items()}
+
+
+def _make_key(args, kwargs) -> Hashable:
+    if kwargs:
+        return args + tuple(sorted(kwargs.items()))
+    return args
+
+
+def async_cache(
+    maxsize: int = 1000,
+    ttl: Optional[float] = DEFAULT_TTL_SECONDS,
+    negative_ttl: Optional[float] = DEFAULT_NEGATIVE_TTL_SECONDS,
+    name: Optional[str] = None,
+):
+    """ Caches results of a coroutine function in a registered TTLCache.
+    Concurrent calls with the same arguments share one in-flight call.
+    The wrapper keeps the `cache_invalidate(*args)` / `cache_clear()`
+      interface of async_lru, the cache is registered under the function name.
+    """
+
+    def decorator(fn):
+        cache = register_cache(name or fn.__name__, TTLCache(maxsize, ttl, negative_ttl))
+        in_flight = cache.in_flight
+
+        async def _load(key, load):
+            task = asyncio.current_task()
+            try:
+                value = await load()
+            except BaseException:
+                # the error is raised from the awaiting callers
+                if in_flight.get(key) is task:
+                    del in_flight[key]
+                raise
+
+            # the key could be invalidated while the query was running
+            if in_flight.get(key) is task:
+                del in_flight[key]
+                cache.set(key, value)
+
+            return value
+
+        async def get_or_load(key, load):
+            found, value = cache.get(key)
+            if found:
+                return value
+
+            pending = in_flight.get(key)
+            if pending is None:
+                pending = asyncio.ensure_future(_load(key, load))
+                in_flight[key] = pending
+
+            return await asyncio.shield(pending)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            return await get_or_load(
+                _make_key(args, kwargs), lambda: fn(*args, **kwargs))
+
+        async def cache_get_or_load(args: tuple, load):
+            """ Same as calling the function, but a miss is loaded with `load()` """
+            return await get_or_load(_make_key(args, {}), load)
+
+        def cache_invalidate(*args, **kwargs) -> bool:
+            return cache.invalidate(_make_key(args, kwargs))
+
+        wrapper.cache = cache
+        wrapper.cache_invalidate = cache_invalidate
+        wrapper.cache_clear = cache.clear
+        wrapper.cache_get_or_load = cache_get_or_load
+        wrapper.cache_info = cache.info
+        return wrapper
+
+    return decorator
@@ -1,15 +1,30 @@
+import os
+import json
+import uuid
+import asyncio
+import time
 import datetime
 import logging
+import functools
+import contextlib
+from collections import defaultdict
+from dataclasses import dataclass
 from typing import Optional
 
+import asyncpg
+
 from sqlalchemy import (
+    exc,
     func,
     text,
     insert,
     select,
     update,
     delete,
+    tuple_,
+    bindparam,
 )
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import (
     create_async_engine,
 )
@@ -17,17 +32,30 @@ from sqlalchemy.orm import (
     joinedload,
     declarative_base,
 )
-from async_lru import alru_cache
 
+from src.analytics.streaks import StreakState, advance_streak
+from src.cache import (
+    async_cache,
+    invalidate_cache as _invalidate_registered_cache,
+)
+from src.metrics_collection.database_metrics import (
+    InstrumentedAsyncQueuePool,
+    instrumented,
+    get_pool_stats as _get_pool_stats,
+)
 from src.models import (
     User,
     Goal,
     Event,
     Category,
+    Streak,
     Submission,
     Leaderboard,
+    LeaderboardSnapshot,
+    LLMResponse,
     ExternalPlatform,
     ExternalPlatformConnection,
+    local_day,
 )
 
 
@@ -35,16 +63,264 @@ from src.models import (
 logger = logging.getLogger(__name__)
 
 DB_ENGINE = None
+# Optional read replica for read-only helpers (analytics, raw selects)
+DB_READ_ENGINE = None
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+# Recycle connections before the server/proxy drops them as idle
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+
+# The replica is skipped when it is behind the primary by more than this
+READ_REPLICA_MAX_LAG_SECONDS = float(os.getenv('READ_REPLICA_MAX_LAG_SECONDS', 30))
+READ_REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv('READ_REPLICA_CHECK_INTERVAL_SECONDS', 15))
+# After a connection error the replica is skipped for this long
+READ_REPLICA_RETRY_SECONDS = float(os.getenv('READ_REPLICA_RETRY_SECONDS', 60))
+
+# Categories are edited directly in the database, nothing invalidates them
+CATEGORIES_CACHE_TTL_SECONDS = float(os.getenv('CATEGORIES_CACHE_TTL_SECONDS', 10 * 60))
+# Weekly stats of a user are invalidated by their submissions,
+#   the TTL only moves the one-week window forward
+PERSONAL_STATS_CACHE_SIZE = int(os.getenv('PERSONAL_STATS_CACHE_SIZE', 5000))
+PERSONAL_STATS_CACHE_TTL_SECONDS = float(os.getenv('PERSONAL_STATS_CACHE_TTL_SECONDS', 10 * 60))
+
+# SQLAlchemy compiled statements cache (per engine)
+DB_QUERY_CACHE_SIZE = int(os.getenv('DB_QUERY_CACHE_SIZE', 1000))
+# asyncpg prepared statements cache (per connection)
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv('DB_PREPARED_STATEMENT_CACHE_SIZE', 500))
+# text() clauses of select_raw queries
+RAW_QUERY_CACHE_SIZE = int(os.getenv('RAW_QUERY_CACHE_SIZE', 256))
+
+
+# Hot statements are built once with bound parameters, so a call only 
+#   looks up the compiled form and the server-side prepared statement.
+_GET_USER_STMT = select(User).where(User.user_id == bindparam('user_id'))
+
+_GET_USERNAMES_STMT = select(User.user_id, User.username).where(
+    User.user_id.in_(bindparam('user_ids', expanding=True)))
+
+_UPSERT_USER_STMT = pg_insert(User).values(
+    user_id=bindparam('user_id'),
+    username=bindparam('username'),
+)
+_UPSERT_USER_STMT = _UPSERT_USER_STMT.on_conflict_do_update(
+    index_elements=[User.user_id],
+    set_={'username': _UPSERT_USER_STMT.excluded.username},
+).returning(User)
+
+_GET_TIME_ZONE_SHIFTS_STMT = select(User.user_id, User.time_zone_shift).where(
+    User.user_id.in_(bindparam('user_ids', expanding=True)))
+
+_UPDATE_USER_LAST_LLM_SUBMISSION_STMT = update(User).where(
+    User.user_id == bindparam('b_user_id'))
+
+_UPDATE_CONNECTION_USER_DATA_STMT = update(ExternalPlatformConnection).where(
+    ExternalPlatformConnection.connection_id == bindparam('b_connection_id'))
+
+_GET_GOAL_STMT = (
+    select(Goal)
+        .where(Goal.category_id == bindparam('category_id'))
+        .where(Goal.user_id == bindparam('user_id'))
+        .order_by(Goal.created_at.desc())
+        .limit(1)
+)
+
+_GET_USER_GOALS_STMT = (
+    select(Goal)
+        .where(Goal.user_id == bindparam('user_id'))
+        .where(Goal.active == True)
+        .order_by(Goal.created_at)
+)
+
+_INSERT_GOAL_STMT = insert(Goal).returning(Goal)
+
+# executed with a list of rows: one INSERT ... VALUES (...), (...) RETURNING
+_INSERT_SUBMISSIONS_STMT = insert(Submission).returning(Submission, sort_by_parameter_order=True)
+
+_INSERT_EVENTS_STMT = insert(Event)
+
+_GET_CATEGORIES_STMT = select(Category)
+_GET_CATEGORY_STMT = select(Category).where(Category.text_channel == bindparam('text_channel'))
+_GET_CATEGORY_BY_NAME_STMT = select(Category).where(Category.name == bindparam('name'))
+_GET_CATEGORY_FOR_VOICE_STMT = select(Category).where(Category.voice_channel == bindparam('voice_channel'))
+
+_GET_EXTERNAL_PLATFORM_STMT = select(ExternalPlatform).where(
+    ExternalPlatform.platform_name == bindparam('platform_name'))
+_GET_EXTERNAL_PLATFORM_BY_ID_STMT = select(ExternalPlatform).where(
+    ExternalPlatform.platform_id == bindparam('platform_id'))
+
+_GET_LEADERBOARD_SNAPSHOT_STMT = select(LeaderboardSnapshot).where(
+    LeaderboardSnapshot.name == bindparam('name'))
+
+_UPSERT_LEADERBOARD_SNAPSHOT_STMT = pg_insert(LeaderboardSnapshot).values(
+    name=bindparam('name'),
+    rows=bindparam('rows'),
+    message_chunks=bindparam('message_chunks'),
+)
+_UPSERT_LEADERBOARD_SNAPSHOT_STMT = _UPSERT_LEADERBOARD_SNAPSHOT_STMT.on_conflict_do_update(
+    index_elements=[LeaderboardSnapshot.name],
+    set_={
+        'computed_at': func.now(),
+        'rows': _UPSERT_LEADERBOARD_SNAPSHOT_STMT.excluded.rows,
+        'message_chunks': _UPSERT_LEADERBOARD_SNAPSHOT_STMT.excluded.message_chunks,
+    },
+)
+
+_GET_LLM_RESPONSE_STMT = select(LLMResponse.response).where(
+    LLMResponse.key == bindparam('key'),
+    LLMResponse.created_at > bindparam('min_created_at'),
+)
+
+# expired responses are deleted by the writes, so the table stays bounded by the TTL
+_SAVE_LLM_RESPONSE_STMT = text("""
+    WITH expired AS (
+        DELETE FROM llm_responses
+            WHERE created_at <= now() - make_interval(secs => :max_age_seconds)
+    )
+    INSERT INTO llm_responses (key, response)
+        VALUES (:key, :response)
+        ON CONFLICT (key) DO UPDATE SET
+            response = excluded.response,
+            created_at = now()
+""")
+
+_NOTIFY_STMT = select(func.pg_notify(bindparam('channel'), bindparam('payload')))
+
+# Rollup of submissions by (user, category, day), see DailyActivity
+_DAILY_ACTIVITY_SELECT = """
+    SELECT s.user_id,
+           g.category_id,
+           local_day(s.created_at, s.time_zone_shift) AS day,
+           count(*) AS submissions,
+           COALESCE(sum(s.amount), 0) AS amount
+        FROM submissions s
+        JOIN goals g ON s.goal_id = g.goal_id
+        WHERE {condition}
+        GROUP BY s.user_id, g.category_id, local_day(s.created_at, s.time_zone_shift)
+"""
+
+_UPDATE_DAILY_ACTIVITY_STMT = text("""
+    INSERT INTO daily_activity (user_id, category_id, day, submissions, amount)
+    """ + _DAILY_ACTIVITY_SELECT.format(condition="s.submission_id = ANY(:submission_ids)") + """
+    ON CONFLICT (user_id, category_id, day) DO UPDATE SET
+        submissions = daily_activity.submissions + excluded.submissions,
+        amount = daily_activity.amount + excluded.amount
+""")
+
+# Streaks of submissions by (user, goal), see Streak.
+#   Consecutive days of a goal have the same `day - row number` (a "run").
+_STREAKS_SELECT = """
+    WITH days AS (
+        SELECT DISTINCT s.user_id, s.goal_id, local_day(s.created_at, s.time_zone_shift) AS day
+            FROM submissions s
+            WHERE s.goal_id IS NOT NULL AND {condition}
+    ), runs AS (
+        SELECT user_id, goal_id, min(day) AS run_start, max(day) AS run_end, count(*) AS length
+            FROM (
+                SELECT user_id, goal_id, day,
+                       day - (ROW_NUMBER() OVER (PARTITION BY user_id, goal_id ORDER BY day))::int AS run
+                    FROM days
+            ) AS days_with_runs
+            GROUP BY user_id, goal_id, run
+    )
+    SELECT DISTINCT ON (user_id, goal_id)
+           user_id,
+           goal_id,
+           run_start AS current_start,
+           run_end AS last_day,
+           length AS current_streak,
+           max(length) OVER (PARTITION BY user_id, goal_id) AS longest_streak
+        FROM runs
+        ORDER BY user_id, goal_id, run_end DESC
+"""
+
+_INSERT_STREAKS_SQL = "INSERT INTO streaks (user_id, goal_id, current_start, last_day, current_streak, longest_streak)"
+
+_RECOMPUTE_STREAKS_STMT = text(
+    _INSERT_STREAKS_SQL
+    + _STREAKS_SELECT.format(condition="s.goal_id = ANY(:goal_ids)")
+    + """
+    ON CONFLICT (user_id, goal_id) DO UPDATE SET
+        current_start = excluded.current_start,
+        last_day = excluded.last_day,
+        current_streak = excluded.current_streak,
+        longest_streak = excluded.longest_streak
+""")
+
+# empty rows, so the streaks of a new goal can be locked like the existing ones
+_CREATE_STREAKS_STMT = pg_insert(Streak).on_conflict_do_nothing(
+    index_elements=[Streak.user_id, Streak.goal_id])
+
+_LOCK_STREAKS_STMT = (
+    select(Streak)
+        .where(tuple_(Streak.user_id, Streak.goal_id).in_(bindparam('keys', expanding=True)))
+        .order_by(Streak.user_id, Streak.goal_id)
+        .with_for_update()
+)
+
+_UPDATE_STREAK_STMT = update(Streak).where(
+    Streak.user_id == bindparam('b_user_id'),
+    Streak.goal_id == bindparam('b_goal_id'),
+)
+
+_GET_USER_STREAKS_STMT = text("""
+    SELECT DISTINCT ON (g.category_id)
+           g.category_id,
+           st.current_start,
+           st.last_day,
+           st.current_streak,
+           st.longest_streak
+        FROM streaks st
+        JOIN goals g ON st.goal_id = g.goal_id
+        WHERE st.user_id = :user_id AND g.active AND st.last_day IS NOT NULL
+        ORDER BY g.category_id, g.created_at DESC
+""")
+
+_GET_WEEKLY_ACTIVITY_STMT = text("""
+    SELECT category_id,
+           sum(submissions) AS submissions,
+           count(*) AS active_days
+        FROM daily_activity
+        WHERE user_id = :user_id
+          AND day > local_day(now(), (SELECT time_zone_shift FROM users WHERE user_id = :user_id)) - 7
+        GROUP BY category_id
+        ORDER BY submissions DESC
+""")
+
+
+@functools.lru_cache(maxsize=RAW_QUERY_CACHE_SIZE)
+def _raw_query(query: str):
+    return text(query)
+
+
+def _create_engine(database_url: str):
+    return create_async_engine(
+        database_url,
+        echo=False,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        query_cache_size=DB_QUERY_CACHE_SIZE,
+        connect_args={
+            'prepared_statement_cache_size': DB_PREPARED_STATEMENT_CACHE_SIZE,
+        },
+    )
 
 
-async def init_db(database_url: str):
-    global DB_ENGINE
+async def init_db(database_url: str, read_database_url: Optional[str] = None):
+    global DB_ENGINE, DB_READ_ENGINE
 
     try:
-        DB_ENGINE = create_async_engine(
-            database_url,
-            echo=False,
-        )
+        DB_ENGINE = _create_engine(database_url)
+
+        if read_database_url:
+            DB_READ_ENGINE = _create_engine(read_database_url)
+            logger.info("Read replica is configured.")
         
         # create tables
         # async with DB_ENGINE.begin() as conn:
@@ -59,11 +335,241 @@ async def init_db(database_url: str):
 async def close_db():
     if DB_ENGINE is not None:
         await DB_ENGINE.dispose()
+    if DB_READ_ENGINE is not None:
+        await DB_READ_ENGINE.dispose()
+
+
+def get_pool_stats() -> dict[str, dict]:
+    """ Returns connection pool stats by engine name """
+    if DB_ENGINE is None:
+        return {}
+
+    stats = {
+        'primary': _get_pool_stats(DB_ENGINE.pool),
+    }
+    if DB_READ_ENGINE is not None:
+        stats['replica'] = _get_pool_stats(DB_READ_ENGINE.pool)
+
+    return stats
+
+
+@dataclass
+class ReadReplicaStatus:
+    lag_seconds: Optional[float] = None
+    # monotonic time until which the replica is not used
+    unavailable_until: float = 0.0
+    fallbacks: int = 0
+
+    @property
+    def is_usable(self) -> bool:
+        if time.monotonic() < self.unavailable_until:
+            return False
+        return self.lag_seconds is None or self.lag_seconds <= READ_REPLICA_MAX_LAG_SECONDS
+
+
+READ_REPLICA_STATUS = ReadReplicaStatus()
+
+# 0 lag when everything received is replayed, otherwise the age of the last replayed transaction
+# (both are NULL on a primary, which is never behind itself)
+_REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
 
+# errors that mean the replica can't be reached (not a problem with the query)
+_CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, exc.InterfaceError, exc.OperationalError)
 
+
+def _mark_replica_unavailable(error: Exception):
+    READ_REPLICA_STATUS.unavailable_until = time.monotonic() + READ_REPLICA_RETRY_SECONDS
+    READ_REPLICA_STATUS.fallbacks += 1
+    logger.warning(f"Read replica is unavailable, using the primary: {error!r}")
+
+
+async def _execute_read(stmt, params: Optional[dict] = None) -> list:
+    """ Runs a read-only statement on the replica, or the primary if 
+    there is no replica or it's down or lagging.
+    """
+    if DB_READ_ENGINE is not None and READ_REPLICA_STATUS.is_usable:
+        try:
+            async with DB_READ_ENGINE.connect() as conn:
+                return (await conn.execute(stmt, params)).fetchall()
+        except _CONNECTION_ERRORS as e:
+            _mark_replica_unavailable(e)
+        except exc.DBAPIError as e:
+            if not e.connection_invalidated:
+                raise
+            _mark_replica_unavailable(e)
+
+    async with DB_ENGINE.connect() as conn:
+        return (await conn.execute(stmt, params)).fetchall()
+
+
+async def monitor_read_replica():
+    """ Keeps the replica lag up to date, returns at once if there is no replica """
+    if DB_READ_ENGINE is None:
+        return
+
+    while True:
+        try:
+            async with DB_READ_ENGINE.connect() as conn:
+                lag_seconds = (await conn.execute(_REPLICA_LAG_QUERY)).scalar()
+            READ_REPLICA_STATUS.lag_seconds = float(lag_seconds)
+            
+            if not READ_REPLICA_STATUS.is_usable:
+                logger.warning(f"Read replica lags {lag_seconds:.1f}s behind, using the primary")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _mark_replica_unavailable(e)
+
+        await asyncio.sleep(READ_REPLICA_CHECK_INTERVAL_SECONDS)
+
+
+# Cached lookups are local to the process, invalidations are broadcasted
+#   with Postgres NOTIFY, so other processes (backfill, other workers) 
+#   drop their stale entries as well.
+CACHE_INVALIDATION_CHANNEL = 'cache_invalidation'
+CACHE_INVALIDATION_RECONNECT_SECONDS = 5
+
+_PROCESS_ID = uuid.uuid4().hex
+
+
+_PENDING_INVALIDATIONS = 'pending_cache_invalidations'
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+_MAX_NOTIFY_PAYLOAD_BYTES = 7900
+
+
+@contextlib.asynccontextmanager
+async def _write_transaction():
+    """ Same as DB_ENGINE.begin(), the cache entries invalidated
+      in the transaction are dropped in this process after the commit.
+    Dropped earlier, a concurrent lookup could cache the row before the commit again.
+    The other processes get all invalidations of the transaction in one notification.
+    """
+    invalidations = []
+    async with DB_ENGINE.begin() as conn:
+        # the info dict lives as long as the DBAPI connection
+        conn.info[_PENDING_INVALIDATIONS] = invalidations
+        try:
+            yield conn
+            if invalidations:
+                await _notify_invalidations(conn, invalidations)
+        finally:
+            conn.info.pop(_PENDING_INVALIDATIONS, None)
+
+    for cache_name, key in dict.fromkeys(invalidations):
+        _invalidate_local_cache(cache_name, key)
+
+
+async def _invalidate_cache(conn, cache_name: str, *key):
+    """ Invalidates the cached lookup in this process and notifies the others.
+    Pass the connection of the writing transaction (see _write_transaction),
+      Postgres delivers the notification and the entry is dropped locally
+      only after the commit.
+    Without a key the whole cache is cleared.
+    """
+    pending_invalidations = conn.info.get(_PENDING_INVALIDATIONS)
+    if pending_invalidations is not None:
+        # notified together with the others at the end of the transaction
+        pending_invalidations.append((cache_name, key or None))
+        return
+
+    _invalidate_local_cache(cache_name, key or None)
+    await _notify_invalidations(conn, [(cache_name, key or None)])
+
+
+def _invalidations_payload(invalidations: list[tuple[str, Optional[tuple]]]) -> str:
+    """ Deduplicated invalidations as [[cache name, key or null], ...]
+    If they don't fit into one notification, the caches are cleared as a whole.
+    """
+    invalidations = list(dict.fromkeys(invalidations))
+    payload = json.dumps({
+        'origin': _PROCESS_ID,
+        'invalidations': [[cache_name, list(key) if key else None] for cache_name, key in invalidations],
+    })
+    if len(payload.encode()) < _MAX_NOTIFY_PAYLOAD_BYTES:
+        return payload
+
+    return json.dumps({
+        'origin': _PROCESS_ID,
+        'invalidations': [[cache_name, None] for cache_name in dict.fromkeys(name for name, _ in invalidations)],
+    })
+
+
+async def _notify_invalidations(conn, invalidations: list[tuple[str, Optional[tuple]]]):
+    await conn.execute(_NOTIFY_STMT, dict(
+        channel=CACHE_INVALIDATION_CHANNEL, payload=_invalidations_payload(invalidations)))
+
+
+def _invalidate_local_cache(cache_name: str, key: Optional[list]):
+    if not _invalidate_registered_cache(cache_name, key):
+        logger.warning(f"Unknown cache {cache_name}, can't invalidate")
+
+
+async def invalidate_cache(cache_name: str, *key):
+    """ Invalidates a registered cache in all processes, e.g. from the admin command """
+    async with _write_transaction() as conn:
+        await _invalidate_cache(conn, cache_name, *key)
+
+    logger.info(f"Invalidated cache {cache_name} (key={key or 'all'})")
+
+
+def _clear_cached_lookups():
+    for cached_lookup in CACHED_LOOKUPS.values():
+        cached_lookup.cache_clear()
+
+
+def _on_cache_invalidation(connection, pid, channel, payload):
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        logger.error(f"Malformed cache invalidation: {payload}")
+        return
+
+    if message.get('origin') == _PROCESS_ID:
+        # already invalidated when the change was made
+        return
+
+    logger.debug(f"Cache invalidation from another process: {message}")
+    for cache_name, key in message['invalidations']:
+        _invalidate_local_cache(cache_name, key)
+
+
+async def listen_for_cache_invalidations():
+    """ Applies cache invalidations made by other processes.
+    Runs forever on a dedicated connection (not taken from the pool).
+    """
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(
+                DB_ENGINE.url.set(drivername='postgresql').render_as_string(hide_password=False))
+            await connection.add_listener(CACHE_INVALIDATION_CHANNEL, _on_cache_invalidation)
+            
+            # notifications could be missed while we were not listening
+            _clear_cached_lookups()
+            logger.info("Listening for cache invalidations")
+
+            while not connection.is_closed():
+                await asyncio.sleep(CACHE_INVALIDATION_RECONNECT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Cache invalidation listener failed")
+        finally:
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+
+        await asyncio.sleep(CACHE_INVALIDATION_RECONNECT_SECONDS)
+
+
+@instrumented
 async def save_user_personal_details(discord_user, email, name) -> User:
     user = await ensure_user(discord_user)
-    async with DB_ENGINE.begin() as conn:
+    async with _write_transaction() as conn:
         cursor = await conn.execute(update(User).where(
             User.user_id==user.user_id).values(
                 email=email, name=name
@@ -71,86 +577,190 @@ async def save_user_personal_details(discord_user, email, name) -> User:
 
         user = cursor.fetchone()
         
-        get_user.cache_invalidate(user.user_id)
+        await _invalidate_cache(conn, 'get_user', user.user_id)
         
         logger.info(f"Updated user name and email for : {user.username} with ID {user.user_id}")
         return user
 
 
-async def _new_user(user_id, username) -> User:
-    """ Create new user
+async def _upsert_user(user_id, username) -> User:
+    """ Create the user or refresh the username in one statement
     Always use ensure_user instead of this function
-    It's not any faster to use this function,
-      because if the user exists, we will not create a new user.
     """
     async with DB_ENGINE.begin() as conn:
-    
-        cursor = await conn.execute(insert(User).values(
-            user_id=user_id,
-            username=username,
-        ).returning(User))
+        cursor = await conn.execute(
+            _UPSERT_USER_STMT, dict(user_id=user_id, username=username))
 
         user = cursor.fetchone()
         
-        get_user.cache_invalidate(user_id)
-        
-        logger.info(f"New user created: {username} with ID {user_id}")
+        logger.info(f"Ensured user: {username} with ID {user_id}")
         return user
 
 
+@instrumented
 async def new_submission(
     user_id, goal_id, proof_url, amount, 
     created_at=None, voice_channel: str = None,
 ) -> Submission:
-    async with DB_ENGINE.begin() as conn:
-        cursor = await conn.execute(insert(Submission).values(
-            user_id=user_id,
-            goal_id=goal_id,
-            proof_url=proof_url,
-            created_at=created_at or datetime.datetime.now(datetime.UTC),
-            amount=amount,
-            is_voice=voice_channel is not None,
-            voice_channel=voice_channel,
-        ).returning(Submission))
+    submissions = await new_submissions_bulk([dict(
+        user_id=user_id,
+        goal_id=goal_id,
+        proof_url=proof_url,
+        amount=amount,
+        created_at=created_at,
+        voice_channel=voice_channel,
+    )])
+    return submissions[0]
+
+
+@instrumented
+async def new_submissions_bulk(submissions: list[dict]) -> list[Submission]:
+    """ Create several submissions in one transaction
+    Each item takes the same keys as `new_submission` arguments.
+    All rows are written with a single multi-row INSERT ... RETURNING
+      (SQLAlchemy "insertmanyvalues" batching of the prebuilt statement),
+      so a multi-goal message costs one round trip and one commit.
+    The daily_activity rollup and the streaks are updated in the same transaction,
+      by the day in the user's time zone.
+    """
+    if not submissions:
+        return []
+
+    async with _write_transaction() as conn:
+        return await _insert_submissions(conn, submissions)
+
+
+async def _insert_submissions(conn, submissions: list[dict]) -> list[Submission]:
+    """ new_submissions_bulk in the given writing transaction """
+    now = datetime.datetime.now(datetime.UTC)
+    values = [
+        dict(
+            user_id=submission['user_id'],
+            goal_id=submission['goal_id'],
+            proof_url=submission.get('proof_url'),
+            created_at=submission.get('created_at') or now,
+            amount=submission['amount'],
+            is_voice=submission.get('voice_channel') is not None,
+            voice_channel=submission.get('voice_channel'),
+        )
+        for submission in submissions
+    ]
+
+    time_zone_shifts = dict((await conn.execute(_GET_TIME_ZONE_SHIFTS_STMT, dict(
+        user_ids=sorted({value['user_id'] for value in values})))).fetchall())
+    for value in values:
+        value['time_zone_shift'] = time_zone_shifts.get(value['user_id'])
+
+    cursor = await conn.execute(_INSERT_SUBMISSIONS_STMT, values)
+
+    created = cursor.fetchall()
+
+    await conn.execute(_UPDATE_DAILY_ACTIVITY_STMT, dict(
+        submission_ids=[submission.submission_id for submission in created]))
+    await _update_streaks(conn, created)
+    
+    user_ids = sorted({submission.user_id for submission in created})
+    for user_id in user_ids:
+        await _invalidate_cache(conn, 'get_weekly_activity', user_id)
+        await _invalidate_cache(conn, 'get_user_streaks', user_id)
 
-        submission = cursor.fetchone()
-        logger.info(f"New submission for user {user_id}")
-        return submission
+    logger.info(f"New submissions ({len(created)}) for users {user_ids}")
+    return created
 
 
+async def _update_streaks(conn, submissions: list[Submission]):
+    """ Advances the streaks of the submitted goals in the writing transaction
+    Each new day is an O(1) update of the locked streak row, only a day before
+      the current streak (a backdated submission) recomputes the goal's history.
+    """
+    days_by_key = defaultdict(set)
+    for submission in submissions:
+        if submission.goal_id is not None:
+            days_by_key[(submission.user_id, submission.goal_id)].add(
+                local_day(submission.created_at, submission.time_zone_shift))
+
+    if not days_by_key:
+        return
+
+    # a fixed order of the row locks, so concurrent writers can't deadlock
+    keys = sorted(days_by_key)
+    await conn.execute(_CREATE_STREAKS_STMT, [
+        dict(user_id=user_id, goal_id=goal_id) for user_id, goal_id in keys
+    ])
+    streaks = (await conn.execute(_LOCK_STREAKS_STMT, dict(keys=keys))).fetchall()
+
+    updates, goals_to_recompute = [], []
+    for streak in streaks:
+        state = None
+        if streak.last_day is not None:
+            state = StreakState(
+                current_start=streak.current_start,
+                last_day=streak.last_day,
+                current_streak=streak.current_streak,
+                longest_streak=streak.longest_streak,
+            )
+
+        for day in sorted(days_by_key[(streak.user_id, streak.goal_id)]):
+            state = advance_streak(state, day)
+            if state is None:
+                break
+
+        if state is None:
+            goals_to_recompute.append(streak.goal_id)
+        else:
+            updates.append(dict(
+                b_user_id=streak.user_id,
+                b_goal_id=streak.goal_id,
+                current_start=state.current_start,
+                last_day=state.last_day,
+                current_streak=state.current_streak,
+                longest_streak=state.longest_streak,
+            ))
+
+    if updates:
+        await conn.execute(_UPDATE_STREAK_STMT, updates)
+    if goals_to_recompute:
+        await conn.execute(_RECOMPUTE_STREAKS_STMT, dict(goal_ids=goals_to_recompute))
+
+
+@instrumented
 async def new_goal(user_id, category_id,goal_description, metric, target, frequency) -> Goal:
-    async with DB_ENGINE.begin() as conn:
-        cursor = await conn.execute(insert(Goal).values(
+    async with _write_transaction() as conn:
+        cursor = await conn.execute(_INSERT_GOAL_STMT, dict(
             user_id=user_id,
             category_id=category_id,
             goal_description=goal_description,
             metric=metric,
             target=target,
             frequency=frequency,
-        ).returning(Goal))
+        ))
 
         goal = cursor.fetchone()
         
-        get_goal.cache_invalidate(category_id, user_id)
+        await _invalidate_cache(conn, 'get_goal', category_id, user_id)
         
         logger.info(f"Attempt to set New Goal for {user_id}")
         return goal
 
 
-@alru_cache(maxsize=1000) 
+@async_cache(maxsize=1000, ttl=CATEGORIES_CACHE_TTL_SECONDS)
+@instrumented
 async def get_category(text_channel) -> Optional[Category]:
     async with DB_ENGINE.begin() as conn:
-        return (await conn.execute(select(Category).where(Category.text_channel == text_channel))).first()
+        return (await conn.execute(
+            _GET_CATEGORY_STMT, dict(text_channel=text_channel))).first()
 
 
-@alru_cache(maxsize=1000)
+@async_cache(maxsize=1000, ttl=CATEGORIES_CACHE_TTL_SECONDS)
+@instrumented
 async def get_category_by_name(name) -> Optional[Category]:
     async with DB_ENGINE.begin() as conn:
-        return (await conn.execute(select(Category).where(
-            Category.name == name))).first()
+        return (await conn.execute(
+            _GET_CATEGORY_BY_NAME_STMT, dict(name=name))).first()
 
 
-@alru_cache(maxsize=1000)
+@async_cache(maxsize=1000, ttl=CATEGORIES_CACHE_TTL_SECONDS)
+@instrumented
 async def get_category_for_voice(voice_channel) -> Optional[Category]:
     # 30_days_ml_5 -> 30_days_ml
     voice_channel_parts = voice_channel.rsplit('_', 1)
@@ -158,35 +768,30 @@ async def get_category_for_voice(voice_channel) -> Optional[Category]:
         voice_channel = voice_channel_parts[0]
         
     async with DB_ENGINE.begin() as conn:
-        return (await conn.execute(select(Category).where(
-            Category.voice_channel == voice_channel))).first()
+        return (await conn.execute(
+            _GET_CATEGORY_FOR_VOICE_STMT, dict(voice_channel=voice_channel))).first()
 
 
-@alru_cache(maxsize=1000)
+@async_cache(maxsize=1000)
+@instrumented
 async def get_user(user_id) -> Optional[User]:
     async with DB_ENGINE.begin() as conn:
-        return (await conn.execute(select(User).where(User.user_id == user_id))).first()
+        return (await conn.execute(_GET_USER_STMT, dict(user_id=user_id))).first()
 
 
-@alru_cache(maxsize=1000)
+@async_cache(maxsize=1000)
+@instrumented
 async def get_goal(category_id, user_id) -> Optional[Goal]:
     async with DB_ENGINE.begin() as conn:
         return (await conn.execute(
-            select(Goal)
-                .where(Goal.category_id == category_id)
-                .where(Goal.user_id == user_id)
-                .order_by(Goal.created_at.desc())
-        )).first()
+            _GET_GOAL_STMT, dict(category_id=category_id, user_id=user_id))).first()
     
 
+@instrumented
 async def get_user_goals(user_id):
     async with DB_ENGINE.begin() as conn:
         all_goals = (await conn.execute(
-            select(Goal)
-                .where(Goal.user_id == user_id)
-                .where(Goal.active == True)
-                .order_by(Goal.created_at)
-        )).fetchall()
+            _GET_USER_GOALS_STMT, dict(user_id=user_id))).fetchall()
 
         goals_by_category = {
             goal.category_id: goal
@@ -196,34 +801,82 @@ async def get_user_goals(user_id):
         return list(goals_by_category.values())
 
 
+@instrumented
 async def ensure_user(discord_user) -> User:
-    user = await get_user(discord_user.id)
-    
-    if user is None:
-        user = await _new_user(
+    """ Returns the user, creating it if needed
+    A cache miss costs a single upsert, which also fills the get_user cache.
+    Concurrent calls for the same user share one query.
+    """
+    def upsert():
+        return _upsert_user(
             user_id=discord_user.id,
             username=discord_user.name,
         )
+
+    user = await get_user.cache_get_or_load((discord_user.id,), upsert)
     
-    return user
+    if user is None:
+        # a "not found" cached by get_user before the user was created
+        get_user.cache_invalidate(discord_user.id)
+        user = await get_user.cache_get_or_load((discord_user.id,), upsert)
     
+    return user
 
 
+@instrumented
 async def get_submission_leaderboard():
     return []
 
 
+@instrumented
 async def select_raw(query, **params):
-    async with DB_ENGINE.begin() as conn:
-        return (await conn.execute(text(query), params)).fetchall()
+    """ Runs a read-only query, it goes to the read replica when there is one """
+    return await _execute_read(_raw_query(query), params)
+
+
+async def stream_partitions(stmt, partition_size: int = 10_000):
+    """ Yields the rows of a read-only statement in lists of up to partition_size
+    The rows come from a server-side cursor, so only one partition is in memory.
+    Uses the read replica when it is usable, without a fallback in the middle of a stream.
+    """
+    engine = DB_ENGINE
+    if DB_READ_ENGINE is not None and READ_REPLICA_STATUS.is_usable:
+        engine = DB_READ_ENGINE
 
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt.execution_options(yield_per=partition_size))
+        async for partition in result.partitions():
+            yield partition
 
-@alru_cache()
+
+@async_cache(maxsize=1, ttl=CATEGORIES_CACHE_TTL_SECONDS)
+@instrumented
 async def get_categories():
     async with DB_ENGINE.begin() as conn:
-        return (await conn.execute(select(Category))).fetchall()
+        return (await conn.execute(_GET_CATEGORIES_STMT)).fetchall()
+
 
+@async_cache(maxsize=PERSONAL_STATS_CACHE_SIZE, ttl=PERSONAL_STATS_CACHE_TTL_SECONDS)
+@instrumented
+async def get_weekly_activity(user_id) -> list:
+    """ Returns rows of (category_id, submissions, active days) of the last week
+    Reads the primary, so a submission is never followed by a stale replica read.
+    """
+    async with DB_ENGINE.connect() as conn:
+        return (await conn.execute(_GET_WEEKLY_ACTIVITY_STMT, dict(user_id=user_id))).fetchall()
 
+
+@async_cache(maxsize=PERSONAL_STATS_CACHE_SIZE, ttl=PERSONAL_STATS_CACHE_TTL_SECONDS)
+@instrumented
+async def get_user_streaks(user_id) -> list:
+    """ Returns rows of (category_id, current_start, last_day, current streak, longest streak)
+    of the latest active goal in each category
+    """
+    async with DB_ENGINE.connect() as conn:
+        return (await conn.execute(_GET_USER_STREAKS_STMT, dict(user_id=user_id))).fetchall()
+
+
+@instrumented
 async def get_submissions_without_proof(user_id, window_hours=24) -> list[Submission]:
     """ Returns submissions for the last 24 hours without proof. """
     min_created_at = datetime.datetime.now() - datetime.timedelta(
@@ -239,6 +892,7 @@ async def get_submissions_without_proof(user_id, window_hours=24) -> list[Submis
         )).fetchall()
 
 
+@instrumented
 async def update_submission_proof(submission_id, proof_url):
     async with DB_ENGINE.begin() as conn:
         await conn.execute(update(Submission).where(
@@ -249,26 +903,43 @@ async def update_submission_proof(submission_id, proof_url):
     logger.info(f"Updated proof for submission {submission_id}")
 
 
+@instrumented
 async def update_user_last_llm_submission(user_id, last_llm_submission):
-    async with DB_ENGINE.begin() as conn:
-        await conn.execute(update(User).where(
-            User.user_id==user_id).values(
-                last_llm_submission=last_llm_submission,
-        ))
+    async with _write_transaction() as conn:
+        await conn.execute(
+            _UPDATE_USER_LAST_LLM_SUBMISSION_STMT,
+            dict(b_user_id=user_id, last_llm_submission=last_llm_submission),
+        )
+
+        await _invalidate_cache(conn, 'get_user', user_id)
 
     logger.info(f"Updated last_llm_submission for user {user_id}")
 
 
+@instrumented
 async def update_user_timezone_shift(user_id, timezone_shift):
-    async with DB_ENGINE.begin() as conn:
+    async with _write_transaction() as conn:
         await conn.execute(update(User).where(
             User.user_id==user_id).values(
                 time_zone_shift=timezone_shift,
         ))
 
+        await _invalidate_cache(conn, 'get_user', user_id)
+
     logger.info(f"Updated time_zone_shift for user {user_id} (shift={timezone_shift})")
 
 
+@instrumented
+async def get_usernames(user_ids: list[int]) -> dict[int, str]:
+    """ Returns {user_id: username} of the known users """
+    if not user_ids:
+        return {}
+
+    rows = await _execute_read(_GET_USERNAMES_STMT, dict(user_ids=list(user_ids)))
+    return {user_id: username for user_id, username in rows if username}
+
+
+@instrumented
 async def get_users_without_timezone_shift():
     async with DB_ENGINE.begin() as conn:
         return (await conn.execute(
@@ -277,6 +948,7 @@ async def get_users_without_timezone_shift():
         )).fetchall()
 
 
+@instrumented
 async def get_users_to_notify(timezone_shift: int):
     logger.info(f"Fetching users to notify for timezone {timezone_shift}")
 
@@ -290,18 +962,17 @@ async def get_users_to_notify(timezone_shift: int):
         .having(func.count(Submission.submission_id) == 0)
     )
     
-    async with DB_ENGINE.begin() as conn:
-        rows = (await conn.execute(stmt)).fetchall()
-
-    return rows
+    return await _execute_read(stmt)
 
 
+@instrumented
 async def list_leaderboards() -> list[Leaderboard]:
     async with DB_ENGINE.begin() as conn:
         leaderboards = await conn.execute(select(Leaderboard))
         return leaderboards.fetchall()
 
 
+@instrumented
 async def update_leaderboard_last_sent(leaderboard_id, timestamp):
     async with DB_ENGINE.begin() as conn:
         await conn.execute(update(Leaderboard).where(
@@ -312,42 +983,141 @@ async def update_leaderboard_last_sent(leaderboard_id, timestamp):
     logger.info(f"Updated last_sent for leaderboard {leaderboard_id}")
 
 
-async def list_submissions_by_voice_channel(voice_channel) -> Submission:
+@async_cache(maxsize=100)
+@instrumented
+async def get_leaderboard_snapshot(name) -> Optional[LeaderboardSnapshot]:
     async with DB_ENGINE.begin() as conn:
         return (await conn.execute(
-            select(Submission)
-                .where(Submission.voice_channel == voice_channel)
-                .order_by(Submission.created_at)
-        )).fetchall()
-    
-    
-async def create_event(user_id, event_type, payload):
+            _GET_LEADERBOARD_SNAPSHOT_STMT, dict(name=name))).first()
+
+
+@instrumented
+async def save_leaderboard_snapshot(name, rows, message_chunks: list[str]):
+    async with _write_transaction() as conn:
+        await conn.execute(_UPSERT_LEADERBOARD_SNAPSHOT_STMT, dict(
+            name=name,
+            rows=rows,
+            message_chunks=message_chunks,
+        ))
+
+        await _invalidate_cache(conn, 'get_leaderboard_snapshot', name)
+
+    logger.info(f"Saved leaderboard snapshot {name}")
+
+
+@instrumented
+async def get_llm_response(key: str, max_age_seconds: float) -> Optional[str]:
+    async with DB_ENGINE.connect() as conn:
+        return (await conn.execute(_GET_LLM_RESPONSE_STMT, dict(
+            key=key,
+            min_created_at=datetime.datetime.now(datetime.UTC) - datetime.timedelta(seconds=max_age_seconds),
+        ))).scalar()
+
+
+@instrumented
+async def save_llm_response(key: str, response: str, max_age_seconds: float):
     async with DB_ENGINE.begin() as conn:
-        cursor = await conn.execute(insert(Event).values(
-            user_id=user_id,
-            event_type=event_type,
-            payload=payload,
-        ).returning(Event))
+        await conn.execute(_SAVE_LLM_RESPONSE_STMT, dict(
+            key=key, response=response, max_age_seconds=max_age_seconds))
 
-        event = cursor.fetchone()
-        logger.info(f"New event for user {user_id}: {event_type}")
-        return event
 
+@instrumented
+async def rebuild_daily_activity(user_id: Optional[int] = None):
+    """ Recomputes the daily_activity rollup from submissions
+    (of one user, or everybody if user_id is None).
+    Concurrent submissions wait for the rebuild and are added on top of it.
+    """
+    if user_id is None:
+        delete_condition, select_condition = "true", "true"
+    else:
+        delete_condition, select_condition = "user_id = :user_id", "s.user_id = :user_id"
+
+    params = dict(user_id=user_id) if user_id is not None else {}
+
+    async with _write_transaction() as conn:
+        await conn.execute(text("LOCK TABLE daily_activity IN EXCLUSIVE MODE"))
+        await conn.execute(text(
+            f"DELETE FROM daily_activity WHERE {delete_condition}"), params)
+        cursor = await conn.execute(text(
+            "INSERT INTO daily_activity (user_id, category_id, day, submissions, amount)"
+            + _DAILY_ACTIVITY_SELECT.format(condition=select_condition)
+        ), params)
+
+        if user_id is None:
+            await _invalidate_cache(conn, 'get_weekly_activity')
+        else:
+            await _invalidate_cache(conn, 'get_weekly_activity', user_id)
+
+    logger.info(f"Rebuilt daily activity (user={user_id or 'all'}): {cursor.rowcount} rows")
+
+
+@instrumented
+async def rebuild_streaks(user_id: Optional[int] = None):
+    """ Recomputes the streaks from the submissions history
+    (of one user, or everybody if user_id is None).
+    """
+    if user_id is None:
+        delete_condition, select_condition = "true", "true"
+    else:
+        delete_condition, select_condition = "user_id = :user_id", "s.user_id = :user_id"
+
+    params = dict(user_id=user_id) if user_id is not None else {}
+
+    async with _write_transaction() as conn:
+        await conn.execute(text("LOCK TABLE streaks IN EXCLUSIVE MODE"))
+        await conn.execute(text(
+            f"DELETE FROM streaks WHERE {delete_condition}"), params)
+        cursor = await conn.execute(text(
+            _INSERT_STREAKS_SQL + _STREAKS_SELECT.format(condition=select_condition)
+        ), params)
+
+        if user_id is None:
+            await _invalidate_cache(conn, 'get_user_streaks')
+        else:
+            await _invalidate_cache(conn, 'get_user_streaks', user_id)
+
+    logger.info(f"Rebuilt streaks (user={user_id or 'all'}): {cursor.rowcount} rows")
+
+
+@instrumented
+async def create_events_bulk(events: list[dict]):
+    """ Write several events with one batched INSERT (executemany of a prepared statement)
+    Each item has user_id, event_type and payload keys.
+    Nothing is returned, the event collection doesn't read the rows back.
+    """
+    if not events:
+        return
 
-@alru_cache(maxsize=1000)
+    async with DB_ENGINE.begin() as conn:
+        await conn.execute(_INSERT_EVENTS_STMT, [
+            dict(
+                user_id=event['user_id'],
+                event_type=event['event_type'],
+                payload=event['payload'],
+            )
+            for event in events
+        ])
+
+    logger.info(f"New events: {len(events)}")
+
+
+@async_cache(maxsize=1000)
+@instrumented
 async def get_external_platform(platform_name) -> Optional[ExternalPlatform]:
     async with DB_ENGINE.begin() as conn:
-        return (await conn.execute(select(ExternalPlatform).where(
-            ExternalPlatform.platform_name == platform_name))).first()
+        return (await conn.execute(
+            _GET_EXTERNAL_PLATFORM_STMT, dict(platform_name=platform_name))).first()
     
 
-@alru_cache(maxsize=1000)
+@async_cache(maxsize=1000)
+@instrumented
 async def get_external_platform_by_id(platform_id) -> Optional[ExternalPlatform]:
     async with DB_ENGINE.begin() as conn:
-        return (await conn.execute(select(ExternalPlatform).where(
-            ExternalPlatform.platform_id == platform_id))).first()
+        return (await conn.execute(
+            _GET_EXTERNAL_PLATFORM_BY_ID_STMT, dict(platform_id=platform_id))).first()
 
 
+@instrumented
 async def get_external_platform_connection(user_id, platform_id) -> Optional[ExternalPlatformConnection]:
     async with DB_ENGINE.begin() as conn:
         return (await conn.execute(select(ExternalPlatformConnection).where(
@@ -356,6 +1126,7 @@ async def get_external_platform_connection(user_id, platform_id) -> Optional[Ext
         ))).first()
     
 
+@instrumented
 async def update_external_platform_connection(connection_id, user_name, user_data):
     async with DB_ENGINE.begin() as conn:
         await conn.execute(update(ExternalPlatformConnection).where(
@@ -368,6 +1139,7 @@ async def update_external_platform_connection(connection_id, user_name, user_dat
     logger.info(f"Updated user data for external platform connection {connection_id}")
 
 
+@instrumented
 async def upsert_external_platform_connection(user_id, platform_id, user_name, user_data=None):
     # fetch the connection first
     connection = await get_external_platform_connection(user_id, platform_id)
@@ -389,17 +1161,45 @@ async def upsert_external_platform_connection(user_id, platform_id, user_name, u
         return connection
 
 
+@instrumented
 async def list_external_platform_connections():
     async with DB_ENGINE.begin() as conn:
         return (await conn.execute(select(ExternalPlatformConnection))).fetchall()
     
 
-async def set_external_platform_connection_user_data(connection_id, user_data):
-    async with DB_ENGINE.begin() as conn:
-        await conn.execute(update(ExternalPlatformConnection).where(
-            ExternalPlatformConnection.connection_id == connection_id,
-        ).values(
-            user_data=user_data,
-        ))
-
-    logger.info(f"Updated user data for external platform connection {connection_id}")
\ No newline at end of file
+@instrumented
+async def save_external_platform_sync(user_data: dict[int, dict], submissions: list[dict]) -> list[Submission]:
+    """ Saves the new user data (the baselines) of the synced connections
+      and the submissions of their diffs in one transaction,
+      so a diff is either saved or detected again on the next sync.
+    `user_data` maps connection ids to their new user data.
+    """
+    async with _write_transaction() as conn:
+        created = await _insert_submissions(conn, submissions) if submissions else []
+
+        if user_data:
+            await conn.execute(_UPDATE_CONNECTION_USER_DATA_STMT, [
+                dict(b_connection_id=connection_id, user_data=data)
+                for connection_id, data in user_data.items()
+            ])
+
+    logger.info(f"Synced {len(user_data)} external platform connections")
+    return created
+
+
+CACHED_LOOKUPS = {
+    cached_lookup.__name__: cached_lookup
+    for cached_lookup in [
+        get_user,
+        get_goal,
+        get_category,
+        get_categories,
+        get_weekly_activity,
+        get_user_streaks,
+        get_leaderboard_snapshot,
+        get_category_by_name,
+        get_category_for_voice,
+        get_external_platform,
+        get_external_platform_by_id,
+    ]
+}
@@ -21,15 +21,29 @@ from src.database import (
     get_category,
     new_submission,
     get_user_goals,
+    get_pool_stats,
+    invalidate_cache,
+    monitor_read_replica,
+    READ_REPLICA_STATUS,
+    listen_for_cache_invalidations,
 )
+from src.cache import CACHES, get_cache_stats
+from src.metrics_collection.database_metrics import get_function_stats
 from src.buttons import TrackSettingsView
 from src.greet_newcomer import greet_newcomer
 from src.llm_features import get_groq_response
+from src.llm_dispatcher import get_llm_dispatcher_stats
 from src.metrics_collection.events import process_event_collection
 from src.submissions.automated_collection import collect_submissions_automatically
 from src.submissions.process_message import process_discord_message
+from src.submissions.llm_submissions import process_submission_parsing_batches
 from src.analytics.personal import get_personal_statistics
-from src.analytics.leaderboard import get_weekly_leaderboard
+from src.analytics.leaderboard import (
+    WEEKLY_LEADERBOARD_SNAPSHOT,
+    get_weekly_ranks,
+    get_leaderboard_message_chunks,
+    refresh_leaderboard_snapshots_periodically,
+)
 from src.submissions.voice_submissions import process_voice_channel_activity
 from src.ui.connected_platforms import ConnectExternalPlatform
 
@@ -166,6 +180,102 @@ async def simulate_join(interaction: discord.Interaction):
     await interaction.followup.send("Simulated join event.", ephemeral=True)
 
 
+DB_STATS_TOP_FUNCTIONS = 8
+
+
+@tree.command(
+    name="db_stats",
+    description="Shows database connection pool and cache stats",
+    guild=discord.Object(id=DISCORD_SERVER_ID),
+)
+@app_commands.checks.has_permissions(administrator=True)
+async def db_stats(interaction: discord.Interaction):
+    msg_parts = []
+    pool_stats = get_pool_stats()
+    for engine_name, stats in pool_stats.items():
+        wait_time = stats['wait_time']
+        msg_parts.append(
+            f"**Pool {engine_name}**\n"
+            f"Checked out: {stats['checked_out']}/{stats['size']} "
+            f"(overflow {stats['overflow']}, max {stats['max_checked_out']})\n"
+            f"Checkouts: {stats['checkouts']}, overflow checkouts: {stats['overflow_checkouts']}, "
+            f"timeouts: {stats['timeouts']}\n"
+            f"Wait p50/p95/p99/max: {wait_time['p50'] * 1000:.1f}/{wait_time['p95'] * 1000:.1f}/"
+            f"{wait_time['p99'] * 1000:.1f}/{wait_time['max'] * 1000:.1f} ms\n"
+        )
+
+    if 'replica' in pool_stats:
+        msg_parts.append(
+            f"**Replica**: lag {READ_REPLICA_STATUS.lag_seconds}s, "
+            f"usable: {READ_REPLICA_STATUS.is_usable}, fallbacks: {READ_REPLICA_STATUS.fallbacks}\n"
+        )
+
+    for cache_name, stats in get_cache_stats().items():
+        msg_parts.append(
+            f"**Cache {cache_name}**: size {stats['size']}/{stats['maxsize']}, "
+            f"hits {stats['hits']}, misses {stats['misses']}, "
+            f"evictions {stats['evictions']}, expirations {stats['expirations']}, "
+            f"invalidations {stats['invalidations']}"
+        )
+
+    slowest_functions = sorted(
+        get_function_stats().items(), key=lambda item: item[1]['total_time'], reverse=True)
+    if slowest_functions:
+        msg_parts.append("\n**Helpers by total time** (calls, errors, p50/p95 ms, rows)")
+    for function_name, stats in slowest_functions[:DB_STATS_TOP_FUNCTIONS]:
+        latency = stats['latency']
+        msg_parts.append(
+            f"{function_name}: {stats['total_time']:.1f}s, {stats['calls']} calls, {stats['errors']} errors, "
+            f"{latency['p50'] * 1000:.1f}/{latency['p95'] * 1000:.1f} ms, {stats['rows']} rows"
+        )
+
+    await interaction.response.send_message(
+        "\n".join(msg_parts)[:2000] or "Database is not initialized", ephemeral=True)
+
+
+@tree.command(
+    name="llm_stats",
+    description="Shows LLM call queues and wait times",
+    guild=discord.Object(id=DISCORD_SERVER_ID),
+)
+@app_commands.checks.has_permissions(administrator=True)
+async def llm_stats(interaction: discord.Interaction):
+    msg_parts = []
+    for provider, stats in get_llm_dispatcher_stats().items():
+        queued_by_priority = ", ".join(
+            f"{priority} {queued}" for priority, queued in stats['queued_by_priority'].items())
+        msg_parts.append(
+            f"**{provider}**\n"
+            f"In flight: {stats['in_flight']}/{stats['concurrency']}, "
+            f"queued: {stats['queued']} ({queued_by_priority}), max queued: {stats['max_queued']}\n"
+            f"Calls: {stats['calls']}, rejected: {stats['rejected']}, displaced: {stats['displaced']}"
+        )
+        for priority, wait_time in stats['wait_time'].items():
+            if wait_time['count']:
+                msg_parts.append(
+                    f"Wait {priority} p50/p95/max: {wait_time['p50'] * 1000:.1f}/"
+                    f"{wait_time['p95'] * 1000:.1f}/{wait_time['max'] * 1000:.1f} ms"
+                )
+
+    await interaction.response.send_message("\n".join(msg_parts)[:2000], ephemeral=True)
+
+
+@tree.command(
+    name="cache_invalidate",
+    description="Drops a cache in all bot processes (e.g. after editing categories)",
+    guild=discord.Object(id=DISCORD_SERVER_ID),
+)
+@app_commands.checks.has_permissions(administrator=True)
+async def cache_invalidate(interaction: discord.Interaction, cache_name: str):
+    if cache_name not in CACHES:
+        await interaction.response.send_message(
+            f"Unknown cache `{cache_name}`, available: {', '.join(CACHES)}", ephemeral=True)
+        return
+
+    await invalidate_cache(cache_name)
+    await interaction.response.send_message(f"Cache `{cache_name}` is invalidated", ephemeral=True)
+
+
 @tree.command(
     name="ask",
     description="Ask a question and get an AI-powered response",
@@ -174,7 +284,7 @@ async def simulate_join(interaction: discord.Interaction):
 async def ask(interaction: discord.Interaction, question: str):
     await interaction.response.defer(thinking=True)
     
-    ai_response = await get_groq_response(question)
+    ai_response = await get_groq_response(question, interaction.user.id)
     
     embed = discord.Embed(
         title=question,
@@ -251,6 +361,41 @@ async def stats_command(interaction):
         for category_name, category_stats in statistics.by_category.items()
     ]
 
+    if statistics.streaks:
+        msg_parts.append("**Streaks** (current / longest, days)")
+        msg_parts.extend(
+            f"{category_name}: {streak.current_streak} / {streak.longest_streak}"
+            for category_name, streak in statistics.streaks.items()
+        )
+
+    msg = "\n".join(msg_parts)
+
+    await interaction.followup.send(msg, ephemeral=False)
+
+
+@tree.command(
+    name="rank",
+    description="Get your rank in the weekly leaderboard",
+    guild=discord.Object(id=DISCORD_SERVER_ID),
+)
+async def rank_command(interaction):
+    await interaction.response.defer(ephemeral=False, thinking=True)
+
+    ranks = await get_weekly_ranks(interaction.user.id)
+    if not ranks:
+        await interaction.followup.send("You have no submissions this week yet.", ephemeral=False)
+        return
+
+    msg_parts = [
+        f">>> **Weekly rank**\n"
+        f"**{interaction.user.global_name}**\n"
+    ] + [
+        f"**{category_name}**: #{rank.rank} of {rank.participants} "
+        f"({rank.standing})\n"
+        f"Submissions: {rank.submissions}, active days: {rank.active_days}\n"
+        for category_name, rank in ranks.items()
+    ]
+
     msg = "\n".join(msg_parts)
 
     await interaction.followup.send(msg, ephemeral=False)
@@ -289,23 +434,10 @@ async def send_weekly_leaderboard():
                     logging.info("Skipping sending leaderboard as it's been less than 24 hours.")
                     return
                 
-    leaderboards = await get_weekly_leaderboard()
-
-    current_date = datetime.now().strftime("%d-%b-%Y")
-
-    msg_parts = [f">>> **Weekly leaderboard: {current_date}**\n"]
-
-    for category, leaderboard in leaderboards.items():
-        if leaderboard:
-            msg_parts.append(f"**{category}**")
-            for user_id, submissions, days in leaderboard:
-                username = (await client.fetch_user(user_id)).global_name
-                msg_parts.append(f"{username}: {submissions} submissions, {days} active days")
-            msg_parts.append("")
-
-    msg = "\n".join(msg_parts)
+    message_chunks = await get_leaderboard_message_chunks(client, WEEKLY_LEADERBOARD_SNAPSHOT)
 
-    # await channel.send(msg)
+    # for message_chunk in message_chunks:
+    #     await channel.send(message_chunk)
     logging.info('Successfully sent weekly leaderboard')
 
 
@@ -314,13 +446,17 @@ async def init():
     if not DATABASE_URL:
         raise Exception("Please set the DATABASE_URL environment variable")
 
-    await init_db(DATABASE_URL)
+    await init_db(DATABASE_URL, os.getenv('READ_DATABASE_URL'))
     discord.utils.setup_logging()
     
     return await asyncio.gather(
         client.start(DISCORD_TOKEN),
         process_event_collection(),
+        process_submission_parsing_batches(),
         collect_submissions_automatically(client),
+        refresh_leaderboard_snapshots_periodically(client),
+        listen_for_cache_invalidations(),
+        monitor_read_replica(),
     )
 
     
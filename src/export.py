@@ -0,0 +1,188 @@
+""" Exports tables for offline analysis.
+
+Usage:
+    python -m src.export --start 2024-01-01 --end 2024-02-01 [--format csv|parquet]
+        [--tables submissions goals ...] [--output-dir exports] [--chunk-size 10000]
+
+Rows with created_at in [start, end) are streamed from a server-side cursor
+and written chunk by chunk, so the memory use doesn't depend on the row count.
+Parquet needs pyarrow (`pip install pyarrow`), it is not a dependency of the bot.
+"""
+import os
+import csv
+import enum
+import json
+import asyncio
+import argparse
+import datetime
+from pathlib import Path
+
+import dotenv
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, Float, Integer, select
+
+from src.database import init_db, close_db, stream_partitions
+from src.models import Event, Goal, Submission, ExternalPlatformConnection
+
+
+EXPORTED_TABLES = {
+    model.__tablename__: model.__table__
+    for model in [Submission, Goal, Event, ExternalPlatformConnection]
+}
+DEFAULT_CHUNK_SIZE = 10_000
+
+
+def _to_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+class CsvWriter:
+    def __init__(self, path: Path, table):
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([column.name for column in table.columns])
+
+    def write(self, rows):
+        self._writer.writerows([[_to_csv_value(value) for value in row] for row in rows])
+
+    def close(self):
+        self._file.close()
+
+
+def _parquet_type(pa, column_type):
+    if isinstance(column_type, (BigInteger, Integer)):
+        return pa.int64()
+    if isinstance(column_type, Float):
+        return pa.float64()
+    if isinstance(column_type, Boolean):
+        return pa.bool_()
+    if isinstance(column_type, DateTime):
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(column_type, Date):
+        return pa.date32()
+    # strings, enums and JSON (serialized)
+    return pa.string()
+
+
+def _to_parquet_value(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+class ParquetWriter:
+    def __init__(self, path: Path, table):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("Parquet export needs pyarrow: pip install pyarrow")
+
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([
+            (column.name, _parquet_type(pyarrow, column.type))
+            for column in table.columns
+        ])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        # one row group per chunk
+        self._writer.write_table(self._pa.Table.from_arrays([
+            self._pa.array([_to_parquet_value(value) for value in column], type=field.type)
+            for column, field in zip(columns, self._schema)
+        ], schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+WRITERS = {
+    'csv': CsvWriter,
+    'parquet': ParquetWriter,
+}
+
+
+async def export_table(
+    table_name: str,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    output_dir: Path,
+    file_format: str = 'csv',
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> int:
+    """ Writes the rows created in [start, end) to a file, returns the number of rows """
+    table = EXPORTED_TABLES[table_name]
+    stmt = (
+        select(table)
+            .where(table.c.created_at >= start)
+            .where(table.c.created_at < end)
+            .order_by(table.c.created_at)
+    )
+
+    path = output_dir / f"{table_name}_{start:%Y%m%d}_{end:%Y%m%d}.{file_format}"
+    writer = WRITERS[file_format](path, table)
+    rows_number = 0
+    try:
+        async for rows in stream_partitions(stmt, chunk_size):
+            writer.write(rows)
+            rows_number += len(rows)
+    finally:
+        writer.close()
+
+    print(f"{table_name}: {rows_number} rows -> {path}")
+    return rows_number
+
+
+async def export(
+    tables: list[str],
+    start: datetime.datetime,
+    end: datetime.datetime,
+    output_dir: Path,
+    file_format: str,
+    chunk_size: int,
+):
+    DATABASE_URL = os.getenv('DATABASE_URL')
+    if not DATABASE_URL:
+        raise Exception("Please set the DATABASE_URL environment variable")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    await init_db(DATABASE_URL, os.getenv('READ_DATABASE_URL'))
+    try:
+        for table_name in tables:
+            await export_table(table_name, start, end, output_dir, file_format, chunk_size)
+    finally:
+        await close_db()
+
+
+def _parse_date(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc)
+
+
+def main():
+    dotenv.load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--start', type=_parse_date, required=True, help="inclusive, UTC")
+    parser.add_argument('--end', type=_parse_date, required=True, help="exclusive, UTC")
+    parser.add_argument('--format', choices=list(WRITERS), default='csv')
+    parser.add_argument('--tables', nargs='+', choices=list(EXPORTED_TABLES), default=list(EXPORTED_TABLES))
+    parser.add_argument('--output-dir', type=Path, default=Path('exports'))
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    asyncio.run(export(args.tables, args.start, args.end, args.output_dir, args.format, args.chunk_size))
+
+
+if __name__ == "__main__":
+    main()
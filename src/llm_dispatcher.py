@@ -0,0 +1,211 @@
+""" Concurrency limits and priorities of the outbound LLM calls.
+
+Each provider has a dispatcher with a fixed number of concurrent calls.
+Waiting calls are served by priority (live submissions, then /ask) and
+round-robin by user within a priority, so a burst of one user doesn't
+delay the others. When LLM_MAX_QUEUED_CALLS are waiting, a new call
+displaces the newest call of a lower priority, or is rejected with
+LLMDispatcherBusy if there is none.
+
+The limits are per process. The backfill script (src/backfill.py) runs
+in its own process with its own dispatchers, so while it runs the provider
+can get up to twice the configured concurrency, and its BACKFILL calls
+are only ordered among themselves, not behind the live submissions of the bot.
+"""
+import os
+import enum
+import time
+import asyncio
+import logging
+import contextlib
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from src.metrics_collection.histogram import Histogram
+
+
+logger = logging.getLogger(__name__)
+
+LLM_OPENAI_CONCURRENCY = int(os.getenv('LLM_OPENAI_CONCURRENCY', 4))
+LLM_GROQ_CONCURRENCY = int(os.getenv('LLM_GROQ_CONCURRENCY', 4))
+LLM_MAX_QUEUED_CALLS = int(os.getenv('LLM_MAX_QUEUED_CALLS', 100))
+
+
+class Priority(enum.IntEnum):
+    """ Lower is served first """
+    LIVE_SUBMISSION = 0
+    BACKFILL = 1
+    ASK = 2
+
+
+class LLMDispatcherBusy(Exception):
+    """ Too many calls are waiting for the provider, retry later """
+
+
+@dataclass
+class DispatcherStats:
+    calls: int = 0
+    rejected: int = 0
+    displaced: int = 0
+    max_queued: int = 0
+    wait_time: dict[Priority, Histogram] = field(
+        default_factory=lambda: {priority: Histogram() for priority in Priority})
+
+
+@dataclass
+class _Waiter:
+    priority: Priority
+    user_id: Optional[int]
+    future: asyncio.Future
+
+
+class LLMDispatcher:
+    def __init__(self, provider: str, concurrency: int, max_queued: int):
+        self.provider = provider
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.stats = DispatcherStats()
+
+        self._in_flight = 0
+        self._queued = 0
+        # priority -> user id -> waiting calls, the users are served in the dict order
+        self._waiters: dict[Priority, OrderedDict[Optional[int], deque[_Waiter]]] = {
+            priority: OrderedDict() for priority in Priority
+        }
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: Priority, user_id: Optional[int] = None):
+        """ Waits for a free call slot of the provider.
+        Raises LLMDispatcherBusy if the queue is full.
+        """
+        await self._acquire(priority, user_id)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: Priority, user_id: Optional[int]):
+        self.stats.calls += 1
+        started = time.perf_counter()
+
+        if self._in_flight < self.concurrency and self._queued == 0:
+            self._in_flight += 1
+            self.stats.wait_time[priority].observe(0.0)
+            return
+
+        if self._queued >= self.max_queued and not self._displace_lower_than(priority):
+            self.stats.rejected += 1
+            raise LLMDispatcherBusy(f"{self._queued} calls to {self.provider} are waiting")
+
+        waiter = _Waiter(priority, user_id, asyncio.get_running_loop().create_future())
+        self._waiters[priority].setdefault(user_id, deque()).append(waiter)
+        self._queued += 1
+        self.stats.max_queued = max(self.stats.max_queued, self._queued)
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.cancelled():
+                self._remove(waiter)
+            else:
+                # the slot was granted right before the cancellation
+                self._release()
+            raise
+
+        self.stats.wait_time[priority].observe(time.perf_counter() - started)
+
+    def _release(self):
+        self._in_flight -= 1
+
+        while self._in_flight < self.concurrency and self._queued:
+            waiter = self._pop_next()
+            if waiter.future.done():
+                # cancelled, but its task hasn't resumed yet
+                continue
+            waiter.future.set_result(None)
+            self._in_flight += 1
+
+    def _pop_next(self) -> _Waiter:
+        for priority in Priority:
+            users = self._waiters[priority]
+            if not users:
+                continue
+
+            user_id, waiters = next(iter(users.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                # the user goes to the end of the line
+                users.move_to_end(user_id)
+            else:
+                del users[user_id]
+
+            self._queued -= 1
+            return waiter
+
+        raise RuntimeError("No waiting calls")
+
+    def _remove(self, waiter: _Waiter):
+        users = self._waiters[waiter.priority]
+        waiters = users.get(waiter.user_id)
+        if waiters is None or waiter not in waiters:
+            return
+
+        waiters.remove(waiter)
+        if not waiters:
+            del users[waiter.user_id]
+        self._queued -= 1
+
+    def _displace_lower_than(self, priority: Priority) -> bool:
+        """ Rejects the newest waiting call with a lower priority to make room """
+        for lower_priority in reversed(Priority):
+            if lower_priority <= priority:
+                return False
+
+            users = self._waiters[lower_priority]
+            if not users:
+                continue
+
+            waiter = users[next(reversed(users))][-1]
+            self._remove(waiter)
+            waiter.future.set_exception(LLMDispatcherBusy(
+                f"Displaced by a {priority.name.lower()} call to {self.provider}"))
+            self.stats.displaced += 1
+            return True
+
+        return False
+
+    def get_stats(self) -> dict:
+        return {
+            'concurrency': self.concurrency,
+            'in_flight': self._in_flight,
+            'queued': self._queued,
+            'queued_by_priority': {
+                priority.name.lower(): sum(len(waiters) for waiters in users.values())
+                for priority, users in self._waiters.items()
+            },
+            'max_queued': self.stats.max_queued,
+            'calls': self.stats.calls,
+            'rejected': self.stats.rejected,
+            'displaced': self.stats.displaced,
+            'wait_time': {
+                priority.name.lower(): histogram.snapshot()
+                for priority, histogram in self.stats.wait_time.items()
+            },
+        }
+
+
+OPENAI_DISPATCHER = LLMDispatcher('openai', LLM_OPENAI_CONCURRENCY, LLM_MAX_QUEUED_CALLS)
+GROQ_DISPATCHER = LLMDispatcher('groq', LLM_GROQ_CONCURRENCY, LLM_MAX_QUEUED_CALLS)
+
+DISPATCHERS = {
+    dispatcher.provider: dispatcher
+    for dispatcher in [OPENAI_DISPATCHER, GROQ_DISPATCHER]
+}
+
+
+def get_llm_dispatcher_stats() -> dict[str, dict]:
+    return {
+        provider: dispatcher.get_stats()
+        for provider, dispatcher in DISPATCHERS.items()
+    }
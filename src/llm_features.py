@@ -1,9 +1,12 @@
 import os
+from typing import Optional
 
 from dotenv import load_dotenv
 import groq
 from groq import AsyncGroq
 
+from src.llm_dispatcher import GROQ_DISPATCHER, LLMDispatcherBusy, Priority
+
 load_dotenv()
 
 groq_client = AsyncGroq(
@@ -11,23 +14,27 @@ groq_client = AsyncGroq(
 )
 
 
-async def get_groq_response(question: str) -> str:
+async def get_groq_response(question: str, user_id: Optional[int] = None) -> str:
     try:
-        response = await groq_client.chat.completions.create(
-            model="llama3-8b-8192",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a helpful assistant for the Break Into Data Discord server."
-                },
-                {
-                    "role": "user", 
-                    "content": question
-                }
-            ],
-            temperature=1.0,
-        )
+        async with GROQ_DISPATCHER.slot(Priority.ASK, user_id):
+            response = await groq_client.chat.completions.create(
+                model="llama3-8b-8192",
+                messages=[
+                    {
+                        "role": "system", 
+                        "content": "You are a helpful assistant for the Break Into Data Discord server."
+                    },
+                    {
+                        "role": "user", 
+                        "content": question
+                    }
+                ],
+                temperature=1.0,
+            )
         return response.choices[0].message.content
+    except LLMDispatcherBusy as e:
+        print(f"The question is not sent: {e}")
+        return "I'm sorry, there are too many questions at the moment. Please try again in a minute."
     except groq.APIConnectionError as e:
         print("The server could not be reached")
         print(e.__cause__)
@@ -0,0 +1,140 @@
+import time
+import logging
+import functools
+from dataclasses import dataclass, field
+
+import sentry_sdk
+from sqlalchemy import exc
+from sqlalchemy.engine import Row
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.metrics_collection.histogram import Histogram
+
+
+ROW_COUNT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    timeouts: int = 0
+    overflow_checkouts: int = 0
+    max_checked_out: int = 0
+    wait_time: Histogram = field(default_factory=Histogram)
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """ Async queue pool that records checkout waits and overflow usage.
+    The wait time includes the pre-ping and opening of new connections,
+      i.e. everything a helper waits for before its first query.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            logger.warning(f"Connection pool timeout: {self.status()}")
+            raise
+        finally:
+            self.stats.wait_time.observe(time.perf_counter() - started)
+
+        checked_out = self.checkedout()
+        self.stats.checkouts += 1
+        self.stats.max_checked_out = max(self.stats.max_checked_out, checked_out)
+        if checked_out > self.size():
+            self.stats.overflow_checkouts += 1
+
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def get_pool_stats(pool: InstrumentedAsyncQueuePool) -> dict:
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': max(pool.overflow(), 0),
+        'checkouts': pool.stats.checkouts,
+        'timeouts': pool.stats.timeouts,
+        'overflow_checkouts': pool.stats.overflow_checkouts,
+        'max_checked_out': pool.stats.max_checked_out,
+        'wait_time': pool.stats.wait_time.snapshot(),
+    }
+
+
+@dataclass
+class FunctionStats:
+    calls: int = 0
+    errors: int = 0
+    rows: int = 0
+    latency: Histogram = field(default_factory=Histogram)
+    row_counts: Histogram = field(default_factory=lambda: Histogram(buckets=ROW_COUNT_BUCKETS))
+
+
+# database helper stats by function name
+FUNCTION_STATS: dict[str, FunctionStats] = {}
+
+
+def _count_rows(result) -> int:
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)) and not isinstance(result, Row):
+        return len(result)
+    return 1
+
+
+def instrumented(fn):
+    """ Records calls, errors, latency and returned rows of a database helper,
+    and wraps each call into a Sentry span.
+    Goes under @async_cache, so only the loads are recorded, the hits are in the cache stats.
+    """
+    stats = FUNCTION_STATS.setdefault(fn.__name__, FunctionStats())
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        stats.calls += 1
+        started = time.perf_counter()
+        with sentry_sdk.start_span(op='db.function', description=fn.__name__) as span:
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception:
+                stats.errors += 1
+                span.set_status('internal_error')
+                raise
+            finally:
+                stats.latency.observe(time.perf_counter() - started)
+
+            rows = _count_rows(result)
+            stats.rows += rows
+            stats.row_counts.observe(rows)
+            span.set_data('db.rows', rows)
+            return result
+
+    return wrapper
+
+
+def get_function_stats() -> dict[str, dict]:
+    return {
+        name: {
+            'calls': stats.calls,
+            'errors': stats.errors,
+            'rows': stats.rows,
+            'total_time': stats.latency.total,
+            'latency': stats.latency.snapshot(),
+            'row_counts': stats.row_counts.snapshot(),
+        }
+        for name, stats in FUNCTION_STATS.items()
+    }
@@ -1,8 +1,10 @@
+import os
 import asyncio
 import logging
 from typing import Optional
 
 from asyncpg import ForeignKeyViolationError
+from sqlalchemy.exc import IntegrityError, StatementError
 
 from src import database
 from src.models import EventType
@@ -10,6 +12,11 @@ from src.models import EventType
 
 logger = logging.getLogger(__name__)
 
+# Events are written in batches of up to EVENTS_BATCH_SIZE,
+#   a batch is flushed at most EVENTS_FLUSH_INTERVAL_MS after its first event
+EVENTS_BATCH_SIZE = int(os.getenv('EVENTS_BATCH_SIZE', 100))
+EVENTS_FLUSH_INTERVAL_MS = int(os.getenv('EVENTS_FLUSH_INTERVAL_MS', 500))
+
 
 events_queue = asyncio.Queue()
 
@@ -18,14 +25,66 @@ def save_event(user_id: int, event_type: EventType, payload: Optional[dict] = No
     events_queue.put_nowait((user_id, event_type, payload))
 
 
-async def process_event_collection():
+def _is_foreign_key_violation(error: IntegrityError) -> bool:
+    return isinstance(getattr(error.orig, '__cause__', None), ForeignKeyViolationError)
+
+
+async def _collect_batch(batch_size: int, flush_interval: float) -> list[tuple]:
+    """ Waits for the first event, then collects more until the batch
+    is full or the flush interval is over.
+    """
+    batch = [await events_queue.get()]
+    deadline = asyncio.get_running_loop().time() + flush_interval
+
+    while len(batch) < batch_size:
+        timeout = deadline - asyncio.get_running_loop().time()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(events_queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+
+    return batch
+
+
+async def _write_events_one_by_one(events: list[dict]):
+    """ Fallback for a failed batch, so one bad row doesn't drop the others """
+    for event in events:
+        try:
+            await database.create_events_bulk([event])
+        except StatementError as e:
+            if isinstance(e, IntegrityError) and _is_foreign_key_violation(e):
+                logger.error('Can\'t create event %s, user %s does not exist', event['event_type'], event['user_id'])
+            else:
+                logger.exception('Failed to save event %s of user %s', event['event_type'], event['user_id'])
+
+
+async def flush_events(batch: list[tuple]):
+    events = [
+        dict(user_id=user_id, event_type=event_type, payload=payload)
+        for user_id, event_type, payload in batch
+    ]
+
+    try:
+        await database.create_events_bulk(events)
+    except StatementError as e:
+        # e.g. a missing user, a bad payload or a dropped connection,
+        #   only the failing events are lost
+        if isinstance(e, IntegrityError) and _is_foreign_key_violation(e):
+            logger.warning('Batch of %s events failed on a missing user, writing one by one', len(events))
+        else:
+            logger.exception('Batch of %s events failed, writing one by one', len(events))
+        await _write_events_one_by_one(events)
+
+
+async def process_event_collection(
+    batch_size: int = EVENTS_BATCH_SIZE,
+    flush_interval_ms: int = EVENTS_FLUSH_INTERVAL_MS,
+):
     while True:
-        user_id, event_type, payload = await events_queue.get()
+        batch = await _collect_batch(batch_size, flush_interval_ms / 1000)
         try:
-            await database.create_event(
-                user_id=user_id,
-                event_type=event_type,
-                payload=payload,
-            )
-        except ForeignKeyViolationError:
-            logger.error('Can\'t create event %s, user %s does not exist', event_type, user_id)
+            await flush_events(batch)
+        except Exception:
+            logger.exception('Failed to save %s events', len(batch))
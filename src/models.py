@@ -1,10 +1,12 @@
 import enum
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
 
 from sqlalchemy import (
     Column,
     Integer,
     String, 
+    Date,
     DateTime,
     Float, 
     Boolean, 
@@ -12,6 +14,9 @@ from sqlalchemy import (
     BigInteger, 
     JSON,
     Enum,
+    Index,
+    DDL,
+    event,
 )
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.sql import func
@@ -20,6 +25,21 @@ from sqlalchemy.sql import func
 Base = declarative_base()
 
 
+# The day of a timestamp for a user `time_zone_shift` hours from UTC.
+#   IMMUTABLE (the shift is a fixed offset), so it can be used in indexes.
+LOCAL_DAY_FUNCTION = DDL("""
+    CREATE OR REPLACE FUNCTION local_day(created_at timestamptz, time_zone_shift integer)
+    RETURNS date AS $$
+        SELECT ((created_at AT TIME ZONE 'UTC') + make_interval(hours => COALESCE(time_zone_shift, 0)))::date
+    $$ LANGUAGE SQL IMMUTABLE PARALLEL SAFE
+""")
+
+
+def local_day(created_at: datetime, time_zone_shift: Optional[int]) -> date:
+    """ Same as the local_day SQL function """
+    return (created_at.astimezone(timezone.utc) + timedelta(hours=time_zone_shift or 0)).date()
+
+
 class TimeZoneEnum(enum.Enum):
     North_America = -5
     South_America = -3
@@ -56,10 +76,36 @@ class Submission(Base):
     amount = Column(Float)
     is_voice = Column(Boolean, default=False)
     voice_channel = Column(String, nullable=True)
+    # the user's time zone when submitted, so the day of a submission
+    #   doesn't move if the user changes the time zone later
+    time_zone_shift = Column(Integer, nullable=True)
 
     user = relationship("User", back_populates="submissions")
     goal = relationship("Goal", back_populates="submissions")
 
+    __table_args__ = (
+        # personal stats, proofs
+        Index('ix_submissions_user_id_created_at', 'user_id', 'created_at'),
+        # submissions of a goal
+        Index('ix_submissions_goal_id_created_at', 'goal_id', 'created_at'),
+        # leaderboards, a time window across all users
+        Index('ix_submissions_created_at', 'created_at'),
+        # voice leaderboards
+        Index('ix_submissions_voice_channel_created_at', 'voice_channel', 'created_at'),
+        # submissions waiting for a proof
+        Index(
+            'ix_submissions_user_id_created_at_without_proof', 'user_id', 'created_at',
+            postgresql_where=proof_url.is_(None),
+        ),
+        # active days and rollups by the user's day, the function only exists in Postgres
+        Index(
+            'ix_submissions_user_id_local_day', 'user_id', func.local_day(created_at, time_zone_shift),
+        ).ddl_if(dialect='postgresql'),
+    )
+
+
+event.listen(Submission.__table__, 'before_create', LOCAL_DAY_FUNCTION.execute_if(dialect='postgresql'))
+
 
 class Category(Base):
     __tablename__ = 'categories'
@@ -91,6 +137,50 @@ class Goal(Base):
     category = relationship("Category", back_populates="goals")
     submissions = relationship("Submission", back_populates="goal")
 
+    __table_args__ = (
+        # latest goal of the user in a category
+        Index('ix_goals_user_id_category_id_created_at', 'user_id', 'category_id', created_at.desc()),
+        # active goals of the user
+        Index('ix_goals_user_id_active_created_at', 'user_id', 'active', 'created_at'),
+        # leaderboards
+        Index('ix_goals_category_id', 'category_id'),
+    )
+
+
+class DailyActivity(Base):
+    """ Submissions rolled up by user, category and day (in the user's time zone)
+    Updated in the same transaction as the submissions (see new_submissions_bulk),
+      rebuilt with `python -m src.analytics.rebuild daily_activity`.
+    """
+    __tablename__ = 'daily_activity'
+
+    user_id = Column(BigInteger, ForeignKey('users.user_id'), primary_key=True)
+    category_id = Column(Integer, ForeignKey('categories.category_id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    submissions = Column(Integer, nullable=False, default=0)
+    amount = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        # leaderboards
+        Index('ix_daily_activity_day_category_id', 'day', 'category_id'),
+    )
+
+
+class Streak(Base):
+    """ Current and longest streaks of consecutive days with submissions of a goal
+    Updated in the same transaction as the submissions (see new_submissions_bulk),
+      rebuilt with `python -m src.analytics.rebuild streaks`.
+    """
+    __tablename__ = 'streaks'
+
+    user_id = Column(BigInteger, ForeignKey('users.user_id'), primary_key=True)
+    goal_id = Column(Integer, ForeignKey('goals.goal_id'), primary_key=True)
+    # NULL until the first submission is counted
+    current_start = Column(Date, nullable=True)
+    last_day = Column(Date, nullable=True)
+    current_streak = Column(Integer, nullable=False, default=0)
+    longest_streak = Column(Integer, nullable=False, default=0)
+
 
 class Leaderboard(Base):
     __tablename__ = 'leaderboards'
@@ -102,6 +192,31 @@ class Leaderboard(Base):
     last_sent = Column(DateTime(timezone=True), nullable=True)
 
 
+class LeaderboardSnapshot(Base):
+    """ Latest precomputed state of a leaderboard,
+    refreshed in the background by refresh_leaderboard_snapshots.
+    `rows` are the ranked rows, `message_chunks` the rendered message
+      split into Discord-sized messages.
+    """
+    __tablename__ = 'leaderboard_snapshots'
+
+    name = Column(String, primary_key=True)
+    computed_at = Column(DateTime(timezone=True), server_default=func.now())
+    rows = Column(JSON, nullable=False)
+    message_chunks = Column(JSON, nullable=False)
+
+
+class LLMResponse(Base):
+    """ Persisted LLM outputs of submission parsing (see src/submissions/llm_cache.py)
+    `key` is a hash of the normalized message and the prompt.
+    """
+    __tablename__ = 'llm_responses'
+
+    key = Column(String, primary_key=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    response = Column(String, nullable=False)
+
+
 class ExternalPlatform(Base):
     __tablename__ = 'external_platforms'
     
@@ -13,11 +13,10 @@ from src.models import ExternalPlatformConnection
 from src.database import (
     get_goal,
     get_user,
-    new_submission,
     get_category_by_name,
     get_external_platform_by_id,
     list_external_platform_connections,
-    set_external_platform_connection_user_data,
+    save_external_platform_sync,
 )
 
 
@@ -104,40 +103,47 @@ async def update_external_platform_data(
     session: aiohttp.ClientSession,
     categories: dict,
     external_connection: ExternalPlatformConnection,
+    pending_syncs: list[dict],
     notification_channel=None,
 ):
+    """ Syncs the platform data for one connection.
+    The new user data and the submission of the diff (if any) are appended
+      to `pending_syncs`, the caller saves them together (see _save_syncs),
+      so a diff is either saved or detected again on the next run.
+    """
     data = await _fetch_external_platform_data(
         session, external_connection
     )
     if data is None:
         return False
 
-    await set_external_platform_connection_user_data(
-        connection_id=external_connection.connection_id,
-        user_data=data,
-    )
+    sync = dict(connection_id=external_connection.connection_id, user_data=data, submission=None)
 
     if not external_connection.user_data:
+        pending_syncs.append(sync)
         return True
     
     category = categories[external_connection.platform_id]
     diffs_sum = sum(data.values()) - sum(external_connection.user_data.values())
 
     if diffs_sum == 0:
+        pending_syncs.append(sync)
         logger.info(f"No changes in platform {external_connection.platform_id} for user {external_connection.user_id}")
         return True
 
     goal = await get_goal(category.category_id, external_connection.user_id)
     if not goal:
+        pending_syncs.append(sync)
         logger.error(f"Goal not found for user {external_connection.user_id} and category {category.category_id}")
         return False
 
-    await new_submission(
+    sync['submission'] = dict(
         user_id=external_connection.user_id,
         goal_id=goal.goal_id,
         proof_url=None,
         amount=diffs_sum,
     )
+    pending_syncs.append(sync)
 
     platform = await get_external_platform_by_id(external_connection.platform_id)
     if not platform:
@@ -153,6 +159,30 @@ async def update_external_platform_data(
     return True
 
 
+async def _save_syncs(syncs: list[dict]):
+    """ Saves all syncs in one transaction, if it fails (e.g. a goal was deleted)
+      each connection is saved in its own transaction, so one bad row doesn't block the others.
+    """
+    try:
+        await save_external_platform_sync(
+            {sync['connection_id']: sync['user_data'] for sync in syncs},
+            [sync['submission'] for sync in syncs if sync['submission'] is not None],
+        )
+        return
+    except Exception:
+        logger.exception(f"Failed to save {len(syncs)} external platform syncs, saving one by one")
+
+    for sync in syncs:
+        try:
+            await save_external_platform_sync(
+                {sync['connection_id']: sync['user_data']},
+                [sync['submission']] if sync['submission'] is not None else [],
+            )
+        except Exception:
+            # neither the submission nor the new user data is saved, the diff is detected again
+            logger.exception(f"Failed to save the sync of external platform connection {sync['connection_id']}")
+
+
 async def _collect_submissions_automatically(client: discord.Client):
     logger.info("Fetching data from external platforms")
     session = aiohttp.ClientSession(
@@ -170,13 +200,25 @@ async def _collect_submissions_automatically(client: discord.Client):
     
     external_connection = await list_external_platform_connections()
     
+    pending_syncs = []
+    
     async with session:            
         for external_connection in external_connection:
-            await update_external_platform_data(
-                session,
-                categories,
-                external_connection,
-            )
+            try:
+                await update_external_platform_data(
+                    session,
+                    categories,
+                    external_connection,
+                    pending_syncs,
+                )
+            except Exception:
+                # the other connections are still synced
+                logger.exception(f"Failed to sync external platform connection {external_connection.connection_id}")
+
+    # nothing is saved before this point, if the run is interrupted
+    #   the next one detects the same diffs
+    if pending_syncs:
+        await _save_syncs(pending_syncs)
 
 
 async def collect_submissions_automatically(client: discord.Client):
@@ -0,0 +1,115 @@
+""" Rule-based parser for trivially structured submissions, e.g. "Fitness 30" or "Coding ✅".
+
+It returns the same (day shift, category, value) items as the LLM CSV,
+and only when every part of the message is understood. Anything else
+(free text, decimals, unknown categories, units other than the goal's
+metric, e.g. "2 hours" for a minutes goal) goes to the LLM.
+"""
+import re
+import functools
+from typing import Optional
+
+
+DONE_VALUES = {'✅', '✔', '✔️', '☑️', 'done', 'yes', 'true', 'completed', 'complete'}
+NOT_DONE_VALUES = {'❌', '✖️', 'no', 'false', 'skipped', 'missed'}
+YESTERDAY_PREFIX = re.compile(r'^yesterday\s*[:\-]?\s*', re.IGNORECASE)
+
+# parts of a message are split by lines, commas and semicolons
+_PARTS_SEPARATOR = re.compile(r'[\n,;]+')
+_NAME_SEPARATOR = re.compile(r'[\s_\-]+')
+# "30", "30 min", "30min", "20 pages"
+_NUMBER_VALUE = re.compile(r'^(\d+)\s*([^\W\d_]*)$')
+_METRIC_WORD = re.compile(r'[^\W\d_]+')
+# "min" is "minutes", but "m" or "h" are too ambiguous
+_MIN_UNIT_LENGTH = 3
+
+
+def _name_key(name: str) -> str:
+    """ "30_days_ml", "30 days ML" and "30-days-ml" are the same category """
+    return _NAME_SEPARATOR.sub(' ', name.strip()).casefold()
+
+
+@functools.lru_cache(maxsize=1024)
+def _category_pattern(category_names: tuple[str, ...]) -> re.Pattern:
+    # the longest names first, so "Coding" doesn't shadow "Coding Interviews"
+    names = sorted(category_names, key=len, reverse=True)
+    alternatives = '|'.join(
+        _NAME_SEPARATOR.pattern.join(re.escape(word) for word in _NAME_SEPARATOR.split(name.strip()))
+        for name in names
+    )
+    return re.compile(rf'^({alternatives})\s*[:\-=]?\s*(.+)$', re.IGNORECASE)
+
+
+def _is_metric_unit(unit: str, metric: str) -> bool:
+    """ "min", "mins" and "minutes" are units of the "minutes" metric, "hrs" is not """
+    unit = unit.casefold()
+    if unit.endswith('s'):
+        unit = unit[:-1]
+    if len(unit) < _MIN_UNIT_LENGTH:
+        return False
+
+    return any(word.startswith(unit) for word in _METRIC_WORD.findall(metric.casefold()))
+
+
+def _parse_value(value: str, metric: str) -> Optional[str]:
+    value = value.strip().rstrip('.!').strip()
+    lowered = value.casefold()
+
+    if lowered in DONE_VALUES:
+        return 'true'
+    if lowered in NOT_DONE_VALUES:
+        return 'false'
+
+    match = _NUMBER_VALUE.match(value)
+    if match is None:
+        return None
+
+    number, unit = match.groups()
+    # the LLM converts the other units, e.g. hours to minutes
+    if not unit or _is_metric_unit(unit, metric):
+        return number
+
+    return None
+
+
+def parse_structured_message(text: str, category_metrics: dict[str, str]) -> Optional[list[tuple[str, str, str]]]:
+    """ Returns [(day shift, category, value)] or None if not confident.
+    `category_metrics` maps the user's categories to the metrics of their goals.
+    """
+    if not category_metrics:
+        return None
+
+    canonical_names = {_name_key(name): name for name in category_metrics}
+    category_pattern = _category_pattern(tuple(category_metrics))
+
+    items = []
+    for part in _PARTS_SEPARATOR.split(text.strip()):
+        part = part.strip()
+        if not part:
+            continue
+
+        day_shift = '0'
+        yesterday = YESTERDAY_PREFIX.match(part)
+        if yesterday:
+            day_shift = '-1'
+            part = part[yesterday.end():]
+
+        match = category_pattern.match(part)
+        if match is None:
+            return None
+
+        category, raw_value = match.groups()
+        category = canonical_names[_name_key(category)]
+        value = _parse_value(raw_value, category_metrics[category] or '')
+        if value is None:
+            return None
+
+        items.append((day_shift, category, value))
+
+    # "yesterday: Fitness 30, Coding 20" might be about yesterday or not only,
+    #   the LLM decides when just some parts have the prefix
+    if len({day_shift for day_shift, _, _ in items}) > 1:
+        return None
+
+    return items or None
+
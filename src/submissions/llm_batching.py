@@ -0,0 +1,200 @@
+""" Micro-batching of the LLM submission parsing.
+
+During bursts (e.g. a challenge deadline) the messages that arrive within
+LLM_BATCH_WINDOW_MS of each other are parsed with one chat completion.
+Each message keeps its own goals, the response has an extra message id
+column and is split back into one CSV per message.
+"""
+import io
+import os
+import csv
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+from src.llm_dispatcher import LLMDispatcherBusy, Priority
+
+
+logger = logging.getLogger(__name__)
+
+LLM_BATCHING_ENABLED = os.getenv('LLM_BATCHING_ENABLED', 'false').lower() == 'true'
+LLM_BATCH_SIZE = int(os.getenv('LLM_BATCH_SIZE', 10))
+LLM_BATCH_WINDOW_MS = int(os.getenv('LLM_BATCH_WINDOW_MS', 300))
+
+
+BATCH_PROMPT = """You will be given several messages from different users, each message with the user's goals. Your task is to extract all the metrics out of every message and return them as one CSV. Only output CSV, no thoughts
+
+Make sure to use this schema:
+<message id>, <day shift>, <category>, <value>
+Message id is the id of the message the metric comes from.
+Day shift is 0 for today's submission, -1 for yesterday's submission and so on.
+If no time is mentioned, then it is 0.
+Only provide metrics from the goals of the same message, ignore others.
+
+Only output data that matches the categories (and the "specifically" part if present).
+If the user did not specify the value, but the category is mentioned as completed, then the value is "true" (meaning that the user completed the goal, but the value is unknown).
+If the user says that they did not complete the goal, then the value is "false".
+"""
+
+
+# (system prompt, user message, priority, user id) -> completion
+Completion = Callable[[str, str, Priority, Optional[int]], Awaitable[str]]
+
+
+@dataclass
+class BatchedMessage:
+    text: str
+    # formatted goals of the user, see llm_submissions._format_category
+    categories: str
+    # the prompt of a single message, used for a batch of one and when a batch fails
+    prompt: str
+    priority: Priority = Priority.LIVE_SUBMISSION
+    user_id: Optional[int] = None
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+llm_batch_queue = asyncio.Queue()
+_batch_tasks = set()
+_processing_batches = False
+
+
+def is_batching_active() -> bool:
+    """ The messages are only queued if the batches are processed in this process,
+    e.g. not in the CLI scripts.
+    """
+    return LLM_BATCHING_ENABLED and _processing_batches
+
+
+async def parse_in_batch(
+    text: str,
+    categories: str,
+    prompt: str,
+    priority: Priority = Priority.LIVE_SUBMISSION,
+    user_id: Optional[int] = None,
+) -> str:
+    """ Returns the CSV of this message, in the single message format """
+    message = BatchedMessage(
+        text=text, categories=categories, prompt=prompt, priority=priority, user_id=user_id)
+    llm_batch_queue.put_nowait(message)
+    return await message.future
+
+
+def format_batch_request(batch: list[BatchedMessage]) -> str:
+    return "\n\n".join(
+        f'<message id="{message_id}">\n'
+        f"<goals>\n{message.categories}\n</goals>\n"
+        f"<text>\n{message.text}\n</text>\n"
+        f"</message>"
+        for message_id, message in enumerate(batch, start=1)
+    )
+
+
+def split_batch_response(csv_data: str, messages_number: int) -> list[str]:
+    """ Splits the batch CSV into a CSV per message, without the message id column """
+    items = [[] for _ in range(messages_number)]
+
+    for row in csv.reader(csv_data.strip('`\n').strip().split('\n')):
+        if len(row) != 4:
+            continue
+
+        message_id, *item = [value.strip() for value in row]
+        if not message_id.isdigit():
+            # the header, if present
+            continue
+
+        index = int(message_id) - 1
+        if 0 <= index < messages_number:
+            items[index].append(item)
+
+    return [_to_csv(message_items) for message_items in items]
+
+
+def _to_csv(items: list[list[str]]) -> str:
+    output = io.StringIO()
+    csv.writer(output, lineterminator='\n').writerows(items)
+    return output.getvalue()
+
+
+def _set_result(future: asyncio.Future, result: str):
+    # the waiting handler might have been cancelled
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, error: Exception):
+    if not future.done():
+        future.set_exception(error)
+
+
+async def _complete_one(message: BatchedMessage, complete: Completion):
+    try:
+        _set_result(message.future, await complete(
+            message.prompt, message.text, message.priority, message.user_id))
+    except Exception as e:
+        _set_exception(message.future, e)
+
+
+async def run_batch(batch: list[BatchedMessage], complete: Completion):
+    if len(batch) == 1:
+        await _complete_one(batch[0], complete)
+        return
+
+    try:
+        # the batch waits for the LLM as its most urgent message
+        priority = min(message.priority for message in batch)
+        csv_data = await complete(BATCH_PROMPT, format_batch_request(batch), priority, None)
+    except LLMDispatcherBusy as e:
+        # retrying one by one would only add to the queue
+        for message in batch:
+            _set_exception(message.future, e)
+        return
+    except Exception:
+        logger.exception('Batch of %s messages failed, parsing one by one', len(batch))
+        await asyncio.gather(*[_complete_one(message, complete) for message in batch])
+        return
+
+    for message, message_csv in zip(batch, split_batch_response(csv_data, len(batch))):
+        _set_result(message.future, message_csv)
+
+
+async def _collect_batch(batch_size: int, window: float) -> list[BatchedMessage]:
+    """ Waits for the first message, then collects more until the batch
+    is full or the window is over.
+    """
+    batch = [await llm_batch_queue.get()]
+    deadline = asyncio.get_running_loop().time() + window
+
+    while len(batch) < batch_size:
+        timeout = deadline - asyncio.get_running_loop().time()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(llm_batch_queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+
+    return batch
+
+
+async def process_llm_batches(
+    complete: Completion,
+    batch_size: int = LLM_BATCH_SIZE,
+    window_ms: int = LLM_BATCH_WINDOW_MS,
+):
+    global _processing_batches
+
+    if not LLM_BATCHING_ENABLED:
+        return
+
+    _processing_batches = True
+    try:
+        while True:
+            batch = await _collect_batch(batch_size, window_ms / 1000)
+            logger.debug('Parsing a batch of %s messages', len(batch))
+            # the next batch is collected while this one waits for the LLM
+            task = asyncio.create_task(run_batch(batch, complete))
+            _batch_tasks.add(task)
+            task.add_done_callback(_batch_tasks.discard)
+    finally:
+        _processing_batches = False
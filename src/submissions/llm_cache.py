@@ -0,0 +1,66 @@
+import os
+import re
+import hashlib
+import logging
+import unicodedata
+from typing import Optional
+
+from src.cache import TTLCache, register_cache
+from src.database import get_llm_response, save_llm_response
+
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', 5000))
+LLM_CACHE_TTL_SECONDS = float(os.getenv('LLM_CACHE_TTL_SECONDS', 7 * 24 * 60 * 60))
+# Keep the responses in the database too, so they survive restarts
+#   and are shared by the bot and the backfill
+LLM_CACHE_PERSIST = os.getenv('LLM_CACHE_PERSIST', 'false').lower() == 'true'
+
+
+LLM_RESPONSES_CACHE = register_cache('llm_responses', TTLCache(
+    maxsize=LLM_CACHE_SIZE,
+    ttl=LLM_CACHE_TTL_SECONDS,
+))
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_message(text: str) -> str:
+    """ Same check-ins written slightly differently get the same key """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = _WHITESPACE.sub(' ', text)
+    return text.strip(' .!?')
+
+
+def llm_cache_key(text: str, model: str, prompt: str) -> str:
+    """ The prompt holds the user's categories and goals,
+    so the key changes with them (and with the prompt or the model).
+    """
+    goals_fingerprint = hashlib.sha256(f"{model}\n{prompt}".encode()).hexdigest()
+    return hashlib.sha256(f"{goals_fingerprint}\n{normalize_message(text)}".encode()).hexdigest()
+
+
+async def get_cached_llm_response(key: str) -> Optional[str]:
+    found, response = LLM_RESPONSES_CACHE.get(key)
+    if found:
+        return response
+
+    if not LLM_CACHE_PERSIST:
+        return None
+
+    response = await get_llm_response(key, LLM_CACHE_TTL_SECONDS)
+    if response is not None:
+        LLM_RESPONSES_CACHE.set(key, response)
+    return response
+
+
+async def cache_llm_response(key: str, response: str):
+    LLM_RESPONSES_CACHE.set(key, response)
+
+    if LLM_CACHE_PERSIST:
+        try:
+            await save_llm_response(key, response, LLM_CACHE_TTL_SECONDS)
+        except Exception:
+            # the response is still cached in memory
+            logger.exception("Failed to persist the LLM response")
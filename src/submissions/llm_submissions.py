@@ -1,15 +1,21 @@
 import csv
 import os
+import asyncio
+import contextlib
 
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime, time, timedelta, timezone
+from typing import AsyncIterator, Optional
 
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 
-from src.models import Goal
+from src.models import Goal, local_day
 from src.database import get_categories
+from src.llm_dispatcher import OPENAI_DISPATCHER, Priority
 from src.submissions.entities import ParsedSubmissionItem
+from src.submissions.llm_cache import llm_cache_key, get_cached_llm_response, cache_llm_response
+from src.submissions.fast_parser import parse_structured_message
+from src.submissions.llm_batching import is_batching_active, parse_in_batch, process_llm_batches
 
 
 load_dotenv()
@@ -18,6 +24,10 @@ openai_client = AsyncOpenAI(
     api_key=os.environ["OPENAI_API_KEY"]
 )
 
+SUBMISSION_PARSING_MODEL = "gpt-4-0125-preview"
+# Parse the response line by line while the model is still generating it
+LLM_STREAMING_ENABLED = os.getenv('LLM_STREAMING_ENABLED', 'false').lower() == 'true'
+
 
 PROMPT = """You will be given a user's message and you task is to you extract all the metrics out of this and return as CSV? Only output CSV, no thoughts
 We need to extract this data:
@@ -70,7 +80,8 @@ def _parse_value(value: str) -> None | int | bool:
 def _process_submission_item(
         day_shift: str, category: str, value: str,
         category_name_to_goal_id: dict[str, int], 
-        created_at: datetime) -> Optional[ParsedSubmissionItem]:
+        created_at: datetime,
+        time_zone_shift: Optional[int] = None) -> Optional[ParsedSubmissionItem]:
     if category == 'category':
         # skip the header, if present
         return None
@@ -82,9 +93,12 @@ def _process_submission_item(
         # today
         submission_time = created_at
     elif day_shift == '-1':
-        # yesterday
-        submission_time = (created_at - timedelta(days=1)).replace(
-            hour=0, minute=0, second=0, microsecond=0)
+        # noon of the user's yesterday, so the submission is on that local day
+        yesterday = local_day(created_at, time_zone_shift) - timedelta(days=1)
+        submission_time = (
+            datetime.combine(yesterday, time(hour=12), tzinfo=timezone.utc)
+            - timedelta(hours=time_zone_shift or 0)
+        )
     else:
         # skip old submissions
         return None
@@ -111,18 +125,27 @@ def _process_submission_item(
 def process_csv_submission(
         csv_data: str, 
         category_name_to_goal_id: dict[str, int],
-        created_at: datetime) -> list[ParsedSubmissionItem]:
+        created_at: datetime,
+        time_zone_shift: Optional[int] = None) -> list[ParsedSubmissionItem]:
     csv_data = csv_data.strip('`\n').strip()
 
     items = list(csv.reader(csv_data.split('\n')))
     items = [item for item in items if len(item) == 3]
 
+    return _process_submission_items(items, category_name_to_goal_id, created_at, time_zone_shift)
+
+
+def _process_submission_items(
+        items: list, 
+        category_name_to_goal_id: dict[str, int],
+        created_at: datetime,
+        time_zone_shift: Optional[int] = None) -> list[ParsedSubmissionItem]:
     parsed_submissions = []
 
     for day_shift, category, value in items:
         submission_item = _process_submission_item(
             day_shift, category, value, 
-            category_name_to_goal_id, created_at
+            category_name_to_goal_id, created_at, time_zone_shift
         )
 
         if submission_item:
@@ -131,7 +154,31 @@ def process_csv_submission(
     return parsed_submissions
 
 
-async def parse_submission_message(text: str, created_at: datetime, goals: list[Goal]) -> list[ParsedSubmissionItem]:
+async def parse_submission_message(
+        text: str,
+        created_at: datetime,
+        goals: list[Goal],
+        user_id: Optional[int] = None,
+        priority: Priority = Priority.LIVE_SUBMISSION,
+        time_zone_shift: Optional[int] = None) -> list[ParsedSubmissionItem]:
+    return [
+        item
+        async for items in stream_submission_message(
+            text, created_at, goals, user_id, priority, time_zone_shift)
+        for item in items
+    ]
+
+
+async def stream_submission_message(
+        text: str,
+        created_at: datetime,
+        goals: list[Goal],
+        user_id: Optional[int] = None,
+        priority: Priority = Priority.LIVE_SUBMISSION,
+        time_zone_shift: Optional[int] = None) -> AsyncIterator[list[ParsedSubmissionItem]]:
+    """ Yields the parsed items as soon as they are known, never an empty list.
+    With LLM_STREAMING_ENABLED, an item is yielded as soon as its line of the LLM response is complete.
+    """
     categories = {
         category.category_id: category.name
         for category in await get_categories()
@@ -144,7 +191,19 @@ async def parse_submission_message(text: str, created_at: datetime, goals: list[
         if goal.category_id in categories
     }
 
-    category_info = [
+    # "Fitness 30" doesn't need the LLM
+    items = parse_structured_message(text, {
+        categories[goal.category_id]: goal.metric
+        for goal in goals
+        if goal.category_id in categories
+    })
+    if items is not None:
+        submission_items = _process_submission_items(items, category_name_to_goal_id, created_at, time_zone_shift)
+        if submission_items:
+            yield submission_items
+        return
+
+    category_info = "\n".join([
         _format_category(
             category_name=categories[goal.category_id], 
             goal_description=goal.goal_description, 
@@ -152,25 +211,124 @@ async def parse_submission_message(text: str, created_at: datetime, goals: list[
         )
         for goal in goals
         if goal.category_id in categories
-    ]
+    ])
 
     prompt = PROMPT.format(
-        categories="\n".join(category_info), 
+        categories=category_info, 
     )
 
-    response = await openai_client.chat.completions.create(
-        model="gpt-4-0125-preview",
-        messages=[{
-            "role": "system",
-            "content": prompt,
-        }, {
-            "role": "user",
-            "content": text,
-        }],
-        temperature=0.0,
-        tool_choice=None
-    )
+    # day shifts are relative, so a cached response works for a new created_at
+    cache_key = llm_cache_key(text, SUBMISSION_PARSING_MODEL, prompt)
+    csv_data = await get_cached_llm_response(cache_key)
+
+    if csv_data is None and LLM_STREAMING_ENABLED and not is_batching_active():
+        lines = []
+        async with contextlib.aclosing(_stream_submission_parsing(prompt, text, priority, user_id)) as stream:
+            async for line in stream:
+                lines.append(line)
+                items = process_csv_submission(line, category_name_to_goal_id, created_at, time_zone_shift)
+                if items:
+                    yield items
+
+        await cache_llm_response(cache_key, "\n".join(lines))
+        return
+
+    if csv_data is None:
+        if is_batching_active():
+            csv_data = await parse_in_batch(text, category_info, prompt, priority, user_id)
+        else:
+            csv_data = await _complete_submission_parsing(prompt, text, priority, user_id)
+        await cache_llm_response(cache_key, csv_data)
+
+    submission_items = process_csv_submission(csv_data, category_name_to_goal_id, created_at, time_zone_shift)
+    if submission_items:
+        yield submission_items
+
+
+async def _complete_submission_parsing(
+        prompt: str, text: str, priority: Priority, user_id: Optional[int]) -> str:
+    async with OPENAI_DISPATCHER.slot(priority, user_id):
+        response = await openai_client.chat.completions.create(
+            model=SUBMISSION_PARSING_MODEL,
+            messages=[{
+                "role": "system",
+                "content": prompt,
+            }, {
+                "role": "user",
+                "content": text,
+            }],
+            temperature=0.0,
+            tool_choice=None
+        )
+
+    return response.choices[0].message.content
+
 
-    csv_data = response.choices[0].message.content
+# put by _read_stream_lines after the last line
+_STREAM_END = object()
 
-    return process_csv_submission(csv_data, category_name_to_goal_id, created_at)
+
+async def _read_stream_lines(
+        prompt: str, text: str, priority: Priority, user_id: Optional[int], lines: asyncio.Queue):
+    """ Puts the complete lines of the response into `lines`, then _STREAM_END or the error.
+    It doesn't wait for the consumer, so the slot is only held while the model is generating.
+    """
+    try:
+        async with OPENAI_DISPATCHER.slot(priority, user_id):
+            stream = await openai_client.chat.completions.create(
+                model=SUBMISSION_PARSING_MODEL,
+                messages=[{
+                    "role": "system",
+                    "content": prompt,
+                }, {
+                    "role": "user",
+                    "content": text,
+                }],
+                temperature=0.0,
+                tool_choice=None,
+                stream=True,
+            )
+
+            buffer = ""
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+
+                buffer += chunk.choices[0].delta.content or ""
+                *complete_lines, buffer = buffer.split("\n")
+                for line in complete_lines:
+                    lines.put_nowait(line)
+
+            if buffer:
+                lines.put_nowait(buffer)
+    except Exception as e:
+        lines.put_nowait(e)
+        return
+
+    lines.put_nowait(_STREAM_END)
+
+
+async def _stream_submission_parsing(
+        prompt: str, text: str, priority: Priority, user_id: Optional[int]) -> AsyncIterator[str]:
+    """ Yields the complete lines of the response
+    The response is read by a separate task, so the replies and the database
+      writes of the caller between the lines don't keep the LLM slot busy.
+    """
+    lines = asyncio.Queue()
+    reader = asyncio.create_task(_read_stream_lines(prompt, text, priority, user_id, lines))
+    try:
+        while True:
+            line = await lines.get()
+            if line is _STREAM_END:
+                return
+            if isinstance(line, Exception):
+                raise line
+            yield line
+    finally:
+        # the caller stopped early or failed, the rest of the response isn't needed
+        reader.cancel()
+
+
+async def process_submission_parsing_batches():
+    """ Background task, parses the queued messages when LLM_BATCHING_ENABLED """
+    await process_llm_batches(_complete_submission_parsing)
@@ -1,3 +1,6 @@
+import logging
+import contextlib
+
 import discord
 from datetime import (
     datetime, 
@@ -8,12 +11,16 @@ from src.database import (
     get_categories,
     get_user_goals, 
     ensure_user,
-    new_submission,
+    new_submissions_bulk,
     update_user_last_llm_submission,
 )
 from src.models import Goal
+from src.llm_dispatcher import LLMDispatcherBusy, Priority
 from src.submissions.entities import ParsedSubmissionItem
-from src.submissions.llm_submissions import parse_submission_message
+from src.submissions.llm_submissions import stream_submission_message
+
+
+logger = logging.getLogger(__name__)
 
 
 def _format_parsed_submission_item(submission_item: ParsedSubmissionItem):
@@ -74,36 +81,59 @@ async def process_submission_message(user, message, is_backfill=False):
         await message.reply("Rate limit exceeded. Please try again later.")
         return False
 
-    submission_items = await parse_submission_message(
-        message.content,
-        message.created_at,
-        user_goals,
-    )
-
-    print(submission_items)
-
-    if not submission_items:
-        if not is_backfill:
-            await message.reply("No submissions found.")
-        return False
-
     categories = {
         category.category_id: category.name
         for category in await get_categories()
     }
-    formatted_message = _format_message(user_goals, submission_items, categories)
-
-    if not is_backfill:
-        await message.reply(formatted_message)
 
-    for item in submission_items:
-        await new_submission(
+    submission_items = []
+    reply = None
+    try:
+        submission_stream = stream_submission_message(
+            message.content,
+            message.created_at,
+            user_goals,
             user_id=user.user_id,
-            goal_id=item.goal_id,
-            proof_url=None,
-            amount=item.value or 0,
-            created_at=item.submission_time,
+            priority=Priority.BACKFILL if is_backfill else Priority.LIVE_SUBMISSION,
+            time_zone_shift=user.time_zone_shift,
         )
+        async with contextlib.aclosing(submission_stream):
+            # with a streamed LLM response the items come one by one,
+            #   the reply and the submissions don't wait for the whole response
+            async for items in submission_stream:
+                submission_items.extend(items)
+
+                if not is_backfill:
+                    formatted_message = _format_message(user_goals, submission_items, categories)
+                    if reply is None:
+                        reply = await message.reply(formatted_message)
+                    else:
+                        await reply.edit(content=formatted_message)
+
+                await new_submissions_bulk([
+                    dict(
+                        user_id=user.user_id,
+                        goal_id=item.goal_id,
+                        proof_url=None,
+                        amount=item.value or 0,
+                        created_at=item.submission_time,
+                    )
+                    for item in items
+                ])
+    except LLMDispatcherBusy as e:
+        logger.warning(f"Submission of user {user.user_id} is not parsed: {e}")
+        if not is_backfill:
+            # the rejected message doesn't count towards the rate limit
+            await update_user_last_llm_submission(user.user_id, user.last_llm_submission)
+            await message.reply("Too many submissions at the moment. Please try again in a few minutes.")
+        return False
+
+    print(submission_items)
+
+    if not submission_items:
+        if not is_backfill:
+            await message.reply("No submissions found.")
+        return False
 
     return True
 
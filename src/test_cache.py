@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from src.cache import TTLCache, async_cache
+from src.metrics_collection.database_metrics import FUNCTION_STATS, instrumented
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=None, negative_ttl=None)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('a') == (True, 1)
+    assert cache.get('b') == (False, None)
+    assert cache.stats.evictions == 1
+
+
+def test_ttl_cache_skips_negative_results_without_negative_ttl():
+    cache = TTLCache(maxsize=10, ttl=None, negative_ttl=0)
+    cache.set('missing', None)
+
+    assert cache.get('missing') == (False, None)
+
+
+@pytest.mark.asyncio
+async def test_async_cache_shares_in_flight_calls():
+    calls = []
+
+    @async_cache(maxsize=10, name='test_shared_lookup')
+    async def lookup(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key * 2
+
+    results = await asyncio.gather(*[lookup(2) for _ in range(5)])
+
+    assert results == [4] * 5
+    assert calls == [2]
+
+    lookup.cache_invalidate(2)
+    assert await lookup(2) == 4
+    assert calls == [2, 2]
+
+
+@pytest.mark.asyncio
+async def test_instrumented_lookup_records_only_cache_misses():
+    @async_cache(maxsize=10, name='test_instrumented_lookup')
+    @instrumented
+    async def test_instrumented_lookup(key):
+        return key
+
+    for _ in range(3):
+        assert await test_instrumented_lookup(1) == 1
+
+    assert FUNCTION_STATS['test_instrumented_lookup'].calls == 1
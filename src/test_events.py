@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from asyncpg import ForeignKeyViolationError
+from sqlalchemy.exc import IntegrityError
+
+from src.models import EventType
+from src.metrics_collection import events
+
+
+MISSING_USER_ID = 2
+
+
+def _foreign_key_violation() -> IntegrityError:
+    orig = Exception('insert or update on table "events" violates foreign key constraint')
+    orig.__cause__ = ForeignKeyViolationError()
+    return IntegrityError('INSERT INTO events ...', {}, orig)
+
+
+@pytest.fixture
+def saved_events(monkeypatch):
+    saved = []
+
+    async def create_events_bulk(rows):
+        # the whole statement fails, like the executemany of a transaction
+        if any(row['user_id'] == MISSING_USER_ID for row in rows):
+            raise _foreign_key_violation()
+        saved.extend(rows)
+
+    monkeypatch.setattr(events.database, 'create_events_bulk', create_events_bulk)
+    return saved
+
+
+@pytest.fixture
+def events_queue(monkeypatch):
+    # the module queue would be shared by the event loops of the tests
+    queue = asyncio.Queue()
+    monkeypatch.setattr(events, 'events_queue', queue)
+    return queue
+
+
+@pytest.mark.asyncio
+async def test_flush_events_keeps_the_rest_of_a_failed_batch(saved_events):
+    batch = [(user_id, EventType.USER_SENT_MESSAGE, None) for user_id in [1, MISSING_USER_ID, 3]]
+
+    await events.flush_events(batch)
+
+    assert [event['user_id'] for event in saved_events] == [1, 3]
+
+
+@pytest.mark.asyncio
+async def test_flush_events_writes_a_batch_at_once(monkeypatch):
+    calls = []
+
+    async def create_events_bulk(rows):
+        calls.append(rows)
+
+    monkeypatch.setattr(events.database, 'create_events_bulk', create_events_bulk)
+
+    await events.flush_events([(user_id, EventType.USER_JOINED, None) for user_id in range(5)])
+
+    assert [len(rows) for rows in calls] == [5]
+
+
+@pytest.mark.asyncio
+async def test_collect_batch_stops_at_the_batch_size(events_queue):
+    for user_id in range(5):
+        events.save_event(user_id, EventType.USER_SENT_MESSAGE)
+
+    # the interval would not be over before the test times out
+    batch = await asyncio.wait_for(events._collect_batch(batch_size=3, flush_interval=60), timeout=1)
+
+    assert [user_id for user_id, _, _ in batch] == [0, 1, 2]
+    assert events_queue.qsize() == 2
+
+
+@pytest.mark.asyncio
+async def test_collect_batch_stops_after_the_flush_interval(events_queue):
+    events.save_event(1, EventType.USER_SENT_MESSAGE)
+    started = asyncio.get_running_loop().time()
+
+    batch = await asyncio.wait_for(events._collect_batch(batch_size=100, flush_interval=0.05), timeout=1)
+
+    assert [user_id for user_id, _, _ in batch] == [1]
+    assert asyncio.get_running_loop().time() - started >= 0.04
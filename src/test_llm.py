@@ -1,8 +1,16 @@
+import asyncio
+from types import SimpleNamespace
+
 import pytest
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
+from src.models import local_day
 from src.submissions import ParsedSubmissionItem
-from src.submissions.llm_submissions import process_csv_submission
+from src.submissions import llm_submissions
+from src.submissions.llm_submissions import process_csv_submission, stream_submission_message
+from src.submissions.llm_cache import llm_cache_key
+from src.submissions.fast_parser import parse_structured_message
+from src.submissions.llm_batching import BATCH_PROMPT, BatchedMessage, run_batch
 
 def test_process_csv_submission():
     # Test Data
@@ -26,3 +34,177 @@ def test_process_csv_submission():
         assert expected_item.value == result_item.value
         # Ensure dates ignoring time
         assert expected_item.submission_time.date() == result_item.submission_time.date()
+
+
+@pytest.mark.parametrize("time_zone_shift, created_at", [
+    # 10:00 local, North America
+    (-5, datetime(2024, 5, 10, 15, 0, tzinfo=timezone.utc)),
+    # 09:00 local, Oceania
+    (11, datetime(2024, 5, 10, 22, 0, tzinfo=timezone.utc)),
+    (None, datetime(2024, 5, 10, 0, 30, tzinfo=timezone.utc)),
+])
+def test_yesterday_is_the_previous_local_day(time_zone_shift, created_at):
+    [item] = process_csv_submission("-1, Fitness, 30", {"Fitness": 1}, created_at, time_zone_shift)
+
+    assert local_day(item.submission_time, time_zone_shift) == local_day(created_at, time_zone_shift) - timedelta(days=1)
+
+
+def test_llm_cache_key_ignores_formatting_but_not_goals():
+    key = llm_cache_key("Did my workout, read 20 pages", "model", "prompt")
+
+    assert llm_cache_key("did my  workout, read 20 pages!", "model", "prompt") == key
+    assert llm_cache_key("did my workout, read 30 pages", "model", "prompt") != key
+    assert llm_cache_key("Did my workout, read 20 pages", "model", "other goals") != key
+
+
+def test_parse_structured_message():
+    categories = {"Fitness": "minutes", "Coding": "minutes", "Coding Interviews": "problems", "30_days_ml": ""}
+
+    assert parse_structured_message("Fitness 30 min\ncoding interviews ✅", categories) == [
+        ("0", "Fitness", "30"),
+        ("0", "Coding Interviews", "true"),
+    ]
+    assert parse_structured_message("yesterday: Coding 20\nyesterday - Fitness 30", categories) == [
+        ("-1", "Coding", "20"),
+        ("-1", "Fitness", "30"),
+    ]
+    assert parse_structured_message("30 days ML: no", categories) == [("0", "30_days_ml", "false")]
+
+
+def test_parse_structured_message_defers_free_text():
+    categories = {"Fitness": "minutes", "Reading": "pages"}
+
+    assert parse_structured_message("Went for a 5k run this morning", categories) is None
+    assert parse_structured_message("Fitness 1.5 hours", categories) is None
+    # the LLM converts the units other than the goal's metric
+    assert parse_structured_message("Fitness 2 hours", categories) is None
+    assert parse_structured_message("Fitness 2h", categories) is None
+    # only the first part says which day it is
+    assert parse_structured_message("yesterday: Fitness 30, Reading 20", categories) is None
+    assert parse_structured_message("Reading 20 pages", categories) == [("0", "Reading", "20")]
+    assert parse_structured_message("Fitness 30, Cooking 20", categories) is None
+
+
+@pytest.mark.asyncio
+async def test_run_batch_splits_the_response_per_message():
+    calls = []
+
+    async def complete(prompt, text, priority, user_id):
+        calls.append(prompt)
+        return "message id, day shift, category, value\n2, 0, Reading, 20\n1, -1, Fitness, true\n1, 0, Fitness, 30"
+
+    batch = [
+        BatchedMessage(text="ran yesterday and today", categories="- Fitness", prompt="fitness prompt"),
+        BatchedMessage(text="read 20 pages", categories="- Reading", prompt="reading prompt"),
+        BatchedMessage(text="nothing", categories="- Coding", prompt="coding prompt"),
+    ]
+    await run_batch(batch, complete)
+
+    assert calls == [BATCH_PROMPT]
+    results = [message.future.result() for message in batch]
+    assert results == ["-1,Fitness,true\n0,Fitness,30\n", "0,Reading,20\n", ""]
+    assert [item.value for item in process_csv_submission(results[0], {"Fitness": 1}, datetime.now())] == [None, 30]
+
+
+@pytest.mark.asyncio
+async def test_run_batch_falls_back_to_single_messages():
+    async def complete(prompt, text, priority, user_id):
+        if prompt == BATCH_PROMPT:
+            raise RuntimeError("rate limited")
+        return f"0, {text}, 1"
+
+    batch = [
+        BatchedMessage(text="Fitness", categories="", prompt="single"),
+        BatchedMessage(text="Reading", categories="", prompt="single"),
+    ]
+    await run_batch(batch, complete)
+
+    assert [message.future.result() for message in batch] == ["0, Fitness, 1", "0, Reading, 1"]
+
+
+@pytest.mark.asyncio
+async def test_stream_submission_message_yields_items_per_line(monkeypatch):
+    first_item_received = asyncio.Event()
+
+    async def response_chunks():
+        for content in ["0, Fit", "ness, 30\n-1, Rea", "ding, true"]:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+            if content.endswith("\n"):
+                # the rest of the response waits for the first item
+                await first_item_received.wait()
+
+    async def create(**kwargs):
+        assert kwargs["stream"] is True
+        return response_chunks()
+
+    async def get_categories():
+        return [
+            SimpleNamespace(category_id=1, name="Fitness", allow_llm_submissions=True),
+            SimpleNamespace(category_id=2, name="Reading", allow_llm_submissions=True),
+        ]
+
+    monkeypatch.setattr(llm_submissions, "LLM_STREAMING_ENABLED", True)
+    monkeypatch.setattr(llm_submissions, "get_categories", get_categories)
+    monkeypatch.setattr(llm_submissions.openai_client.chat.completions, "create", create)
+
+    goals = [
+        SimpleNamespace(goal_id=10, category_id=1, goal_description=None, metric="minutes"),
+        SimpleNamespace(goal_id=20, category_id=2, goal_description=None, metric="pages"),
+    ]
+    received = []
+    async for items in stream_submission_message("ran for half an hour, read yesterday", datetime.now(), goals):
+        received.append([(item.goal_id, item.value) for item in items])
+        first_item_received.set()
+
+    assert received == [[(10, 30)], [(20, None)]]
+
+
+@pytest.mark.asyncio
+async def test_stream_submission_message_releases_the_slot_before_the_caller_is_done(monkeypatch):
+    response_read = asyncio.Event()
+
+    async def response_chunks():
+        for content in ["0, Fitness, 30\n", "-1, Reading, true"]:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+        response_read.set()
+
+    async def create(**kwargs):
+        return response_chunks()
+
+    async def get_categories():
+        return [
+            SimpleNamespace(category_id=1, name="Fitness", allow_llm_submissions=True),
+            SimpleNamespace(category_id=2, name="Reading", allow_llm_submissions=True),
+        ]
+
+    monkeypatch.setattr(llm_submissions, "LLM_STREAMING_ENABLED", True)
+    monkeypatch.setattr(llm_submissions, "get_categories", get_categories)
+    monkeypatch.setattr(llm_submissions.openai_client.chat.completions, "create", create)
+
+    goals = [
+        SimpleNamespace(goal_id=10, category_id=1, goal_description=None, metric="minutes"),
+        SimpleNamespace(goal_id=20, category_id=2, goal_description=None, metric="pages"),
+    ]
+    received = []
+    async for items in stream_submission_message("30 minutes of running, read yesterday", datetime.now(), goals):
+        if not received:
+            # e.g. replying to the first item, while the model finishes the response
+            await asyncio.wait_for(response_read.wait(), timeout=1)
+            assert llm_submissions.OPENAI_DISPATCHER.get_stats()["in_flight"] == 0
+        received.append([(item.goal_id, item.value) for item in items])
+
+    assert received == [[(10, 30)], [(20, None)]]
+
+
+@pytest.mark.asyncio
+async def test_stream_submission_message_skips_empty_results(monkeypatch):
+    async def get_categories():
+        return [SimpleNamespace(category_id=1, name="Fitness", allow_llm_submissions=True)]
+
+    monkeypatch.setattr(llm_submissions, "get_categories", get_categories)
+
+    goals = [SimpleNamespace(goal_id=10, category_id=1, goal_description=None, metric="minutes")]
+    # parsed without the LLM, a goal that is not done is not a submission
+    received = [items async for items in stream_submission_message("Fitness: no", datetime.now(), goals)]
+
+    assert received == []
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from src.llm_dispatcher import LLMDispatcher, LLMDispatcherBusy, Priority
+
+
+async def _call(dispatcher, order, name, priority, user_id=None, release=None):
+    async with dispatcher.slot(priority, user_id):
+        order.append(name)
+        if release is not None:
+            await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_serves_by_priority_then_round_robin_by_user():
+    dispatcher = LLMDispatcher('test', concurrency=1, max_queued=10)
+    order = []
+    release = asyncio.Event()
+
+    first = asyncio.create_task(_call(dispatcher, order, 'first', Priority.LIVE_SUBMISSION, release=release))
+    await asyncio.sleep(0)
+
+    waiting = [
+        asyncio.create_task(_call(dispatcher, order, name, priority, user_id))
+        for name, priority, user_id in [
+            ('ask', Priority.ASK, 1),
+            ('backfill', Priority.BACKFILL, 1),
+            ('user 1 a', Priority.LIVE_SUBMISSION, 1),
+            ('user 1 b', Priority.LIVE_SUBMISSION, 1),
+            ('user 2', Priority.LIVE_SUBMISSION, 2),
+        ]
+    ]
+    await asyncio.sleep(0)
+    assert dispatcher.get_stats()['queued'] == 5
+
+    release.set()
+    await asyncio.gather(first, *waiting)
+
+    assert order == ['first', 'user 1 a', 'user 2', 'user 1 b', 'backfill', 'ask']
+    assert dispatcher.get_stats()['in_flight'] == 0
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_backpressure():
+    dispatcher = LLMDispatcher('test', concurrency=1, max_queued=1)
+    order = []
+    release = asyncio.Event()
+
+    running = asyncio.create_task(_call(dispatcher, order, 'running', Priority.ASK, release=release))
+    ask = asyncio.create_task(_call(dispatcher, order, 'ask', Priority.ASK))
+    await asyncio.sleep(0)
+
+    # the queue is full of calls with the same priority
+    with pytest.raises(LLMDispatcherBusy):
+        await _call(dispatcher, order, 'another ask', Priority.ASK)
+
+    # a submission displaces the waiting question
+    submission = asyncio.create_task(_call(dispatcher, order, 'submission', Priority.LIVE_SUBMISSION))
+    await asyncio.sleep(0)
+    with pytest.raises(LLMDispatcherBusy):
+        await ask
+
+    release.set()
+    await asyncio.gather(running, submission)
+
+    assert order == ['running', 'submission']
+    stats = dispatcher.get_stats()
+    assert (stats['rejected'], stats['displaced'], stats['queued']) == (1, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_cancelled_waiter_leaves_the_queue():
+    dispatcher = LLMDispatcher('test', concurrency=1, max_queued=10)
+    order = []
+    release = asyncio.Event()
+
+    running = asyncio.create_task(_call(dispatcher, order, 'running', Priority.LIVE_SUBMISSION, release=release))
+    cancelled = asyncio.create_task(_call(dispatcher, order, 'cancelled', Priority.LIVE_SUBMISSION))
+    waiting = asyncio.create_task(_call(dispatcher, order, 'waiting', Priority.LIVE_SUBMISSION))
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    release.set()
+    await asyncio.gather(running, waiting)
+
+    assert order == ['running', 'waiting']
+    assert dispatcher.get_stats()['queued'] == 0
+    assert dispatcher.get_stats()['in_flight'] == 0
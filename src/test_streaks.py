@@ -0,0 +1,43 @@
+import datetime
+
+from src.analytics.streaks import StreakState, advance_streak
+
+
+DAY = datetime.date(2024, 5, 10)
+
+
+def _days(n):
+    return datetime.timedelta(days=n)
+
+
+def test_streak_grows_on_consecutive_days_and_restarts_after_a_gap():
+    state = None
+    for day in [DAY, DAY + _days(1), DAY + _days(2), DAY + _days(5)]:
+        state = advance_streak(state, day)
+
+    assert state == StreakState(
+        current_start=DAY + _days(5),
+        last_day=DAY + _days(5),
+        current_streak=1,
+        longest_streak=3,
+    )
+
+
+def test_streak_ignores_days_already_counted():
+    state = advance_streak(advance_streak(None, DAY), DAY + _days(1))
+
+    assert advance_streak(state, DAY) == state
+    assert advance_streak(state, DAY + _days(1)) == state
+
+
+def test_backdated_day_before_the_streak_needs_a_recompute():
+    state = advance_streak(None, DAY)
+
+    assert advance_streak(state, DAY - _days(1)) is None
+
+
+def test_current_streak_is_alive_until_the_end_of_the_next_day():
+    state = advance_streak(None, DAY)
+
+    assert state.current_streak_on(DAY + _days(1)) == 1
+    assert state.current_streak_on(DAY + _days(2)) == 0